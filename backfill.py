@@ -0,0 +1,123 @@
+import os, json
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from idutils import normalize_doi
+from harvest import get_crossref_ror, get_dimensions
+from wos import get_wos_dois
+from traceback import format_exc
+from utils import format_error
+
+FETCHERS = {
+    "crossref": lambda start, end: get_crossref_ror(start, end, date_type="pub"),
+    "dimensions": lambda start, end: get_dimensions(since=start, until=end),
+    "wos": lambda start, end: get_wos_dois(None, publish_span=(start, end)),
+}
+
+WINDOW_DAYS = {"day": 1, "week": 7, "month": 30}
+
+
+def date_windows(start, end, days):
+    # Split the inclusive date range into consecutive windows of days
+    windows = []
+    current = start
+    while current <= end:
+        window_end = min(current + datetime.timedelta(days=days - 1), end)
+        windows.append((current.isoformat(), window_end.isoformat()))
+        current = window_end + datetime.timedelta(days=1)
+    return windows
+
+
+class Backfill:
+    """Harvests source/date windows concurrently and resumably.
+
+    Completed windows are recorded in the state file, and each window's
+    DOIs are merged into the output file as soon as it finishes.
+    """
+
+    def __init__(self, state_file, output_file):
+        self.state_file = state_file
+        self.output_file = output_file
+        self.lock = threading.Lock()
+        self.complete = {}
+        if os.path.exists(state_file):
+            with open(state_file) as infile:
+                self.complete = json.load(infile)["complete"]
+        self.seen = set()
+        if os.path.exists(output_file):
+            with open(output_file) as infile:
+                self.seen = {doi.lower() for doi in infile.read().splitlines()}
+
+    def window_done(self, key, dois):
+        with self.lock:
+            new = []
+            for doi in dois:
+                doi = normalize_doi(doi)
+                if doi.lower() not in self.seen:
+                    self.seen.add(doi.lower())
+                    new.append(doi)
+            with open(self.output_file, "a") as outfile:
+                outfile.write("".join(f"{doi}\n" for doi in new))
+            self.complete[key] = len(dois)
+            tmp = self.state_file + ".tmp"
+            with open(tmp, "w") as outfile:
+                json.dump({"complete": self.complete}, outfile, indent=2)
+            os.replace(tmp, self.state_file)
+            return len(new)
+
+    def run(self, sources, windows, workers):
+        jobs = [
+            (f"{source}:{start}:{end}", source, start, end)
+            for source in sources
+            for start, end in windows
+            if f"{source}:{start}:{end}" not in self.complete
+        ]
+        print(f"{len(jobs)} windows to harvest, {len(self.complete)} already complete")
+        failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(FETCHERS[source], start, end): key
+                for key, source, start, end in jobs
+            }
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    dois = future.result()
+                except Exception as e:
+                    cleaned = format_error(format_exc())
+                    print(f"error= system error with window {key} {cleaned}")
+                    failed += 1
+                    continue
+                new = self.window_done(key, dois)
+                print(f"{key} {len(dois)} DOIs, {new} new")
+        return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Backfill DOIs for a date range in concurrent date windows"
+    )
+    parser.add_argument("start", help="First publication date (YYYY-MM-DD)")
+    parser.add_argument("end", help="Last publication date (YYYY-MM-DD)")
+    parser.add_argument(
+        "-sources", help="Comma separated sources", default="crossref,dimensions,wos"
+    )
+    parser.add_argument("-window", help="day, week or month", default="week")
+    parser.add_argument("-workers", help="Concurrent windows", type=int, default=4)
+    parser.add_argument(
+        "-state", help="Completed window file", default="backfill_state.json"
+    )
+    parser.add_argument(
+        "-output", help="File the DOIs are merged into", default="backfill_dois.txt"
+    )
+    args = parser.parse_args()
+
+    start = datetime.date.fromisoformat(args.start)
+    end = datetime.date.fromisoformat(args.end)
+    windows = date_windows(start, end, WINDOW_DAYS[args.window])
+    backfill = Backfill(args.state, args.output)
+    failed = backfill.run(args.sources.split(","), windows, args.workers)
+    if failed:
+        print(f"{failed} windows failed, run again to resume")
+        exit(1)
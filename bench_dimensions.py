@@ -0,0 +1,101 @@
+import json
+import argparse
+import copy
+import time
+
+import harvest
+
+# A few institutions shared by every author, as on collaboration papers
+GRIDS = {
+    "grid.168010.e": "00f54p054",
+    "grid.5801.c": "05a28rw58",
+    "grid.9132.9": "01ggx4157",
+}
+
+
+def make_fixture(authors):
+    # A collaboration paper shaped like doi2rdm output and a Dimensions
+    # publication, with every author sharing a few affiliations
+    creators = []
+    dimensions_authors = []
+    grids = list(GRIDS)
+    for i in range(authors):
+        creators.append(
+            {
+                "person_or_org": {
+                    "type": "personal",
+                    "given_name": f"Given{i}",
+                    "family_name": f"Family{i}",
+                    "name": f"Family{i}, Given{i}",
+                },
+                "role": {"id": "author"},
+            }
+        )
+        affiliations = [
+            {"id": grid, "raw_affiliation": f"Institution {grid}"}
+            for grid in grids[: 1 + i % len(grids)]
+        ]
+        dimensions_authors.append(
+            {
+                "first_name": f"Given{i}",
+                "last_name": f"Family{i}",
+                "orcid": [f"0000-0002-{i // 10000:04d}-{i % 10000:04d}"],
+                "affiliations": affiliations,
+            }
+        )
+    record = {
+        "metadata": {
+            "title": "A hyperauthor collaboration paper",
+            "creators": creators,
+            "resource_type": {"id": "publication-article"},
+        },
+        "pids": {"doi": {"identifier": "10.1234/bench", "provider": "external"}},
+    }
+    publication = {"authors": dimensions_authors, "pmid": "12345678"}
+    return record, publication
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark Dimensions alignment for hyperauthor records"
+    )
+    parser.add_argument("-authors", type=int, default=5000, help="Author count")
+    parser.add_argument(
+        "-latency",
+        type=float,
+        default=0.005,
+        help="Simulated seconds per ROR API lookup",
+    )
+    args = parser.parse_args()
+
+    lookups = []
+
+    def fake_grid_to_ror(grid):
+        # Stands in for the ROR API, which is what the cache saves
+        lookups.append(grid)
+        time.sleep(args.latency)
+        return GRIDS.get(grid)
+
+    harvest._grid_to_ror = fake_grid_to_ror
+    record, publication = make_fixture(args.authors)
+    print(f"{args.authors} authors, {args.latency}s per ROR lookup")
+
+    results = []
+    # The uncached lookup is how every affiliation was resolved before
+    for name, lookup in [
+        ("uncached grid_to_ror", harvest.grid_to_ror.__wrapped__),
+        ("cached grid_to_ror", harvest.grid_to_ror),
+    ]:
+        harvest.grid_to_ror.cache_clear()
+        cached = harvest.grid_to_ror
+        harvest.grid_to_ror = lookup
+        lookups.clear()
+        start = time.perf_counter()
+        result = harvest.merge_dimensions_metadata(
+            copy.deepcopy(record), copy.deepcopy(publication), ""
+        )
+        elapsed = time.perf_counter() - start
+        harvest.grid_to_ror = cached
+        print(f"{name:<24} {elapsed:>8.2f} s {len(lookups):>7} ROR lookups")
+        results.append(json.dumps(result, sort_keys=True))
+    assert results[0] == results[1]
@@ -3,35 +3,99 @@ import csv
 import json
 import os
 
-import requests
+from sessions import get_session
+from tracing import span
 
 
-def check_doi(doi, production=True, token=None):
-    # Returns whether or not a DOI has already been added to CaltechAUTHORS
+# DOIs per search, which keeps the query well under URL length limits
+BATCH_SIZE = 50
+
+
+def _quote(doi):
+    escaped = doi.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def check_dois(dois, production=True, token=None, batch_size=BATCH_SIZE):
+    # Returns a dict of whether each DOI has already been added to
+    # CaltechAUTHORS, using one OR'd search per batch of DOIs
 
     if production == True:
         url = "https://authors.library.caltech.edu/api/records"
     else:
         url = "https://authors.caltechlibrary.dev/api/records"
 
-    query = f'?q=pids.doi.identifier:"{doi}"&allversions=true'
-
     if token:
         headers = {"Authorization": f"Bearer {token}"}
     else:
         headers = {}
 
-    response = requests.get(url + query, headers=headers)
+    found = set()
+    dois = list(dict.fromkeys(dois))
+    for i in range(0, len(dois), batch_size):
+        batch = dois[i : i + batch_size]
+        terms = " OR ".join(_quote(doi) for doi in batch)
+        params = {
+            "q": f"pids.doi.identifier:({terms})",
+            "allversions": "true",
+            # Every version of a record is a hit
+            "size": 100,
+        }
+        next_url = url
+        with span("check_dois", dois=len(batch)):
+            while next_url:
+                response = get_session().get(next_url, params=params, headers=headers)
+                if response.status_code != 200:
+                    raise Exception(response.text)
+                metadata = response.json()
+                for hit in metadata["hits"]["hits"]:
+                    doi = hit.get("pids", {}).get("doi", {}).get("identifier")
+                    if doi:
+                        found.add(doi.lower())
+                # The next link carries the query parameters itself
+                next_url = metadata.get("links", {}).get("next")
+                params = None
+    return {doi: doi.lower() in found for doi in dois}
+
+
+def check_doi(doi, production=True, token=None):
+    # Returns whether or not a DOI has already been added to CaltechAUTHORS
+    return check_dois([doi], production=production, token=token)[doi]
+
+
+def check_written(title, doi=None, production=True, token=None):
+    # Returns whether a write that raised got far enough to leave something
+    # behind: a record with the DOI, or one of our drafts or an open review
+    # request with the title. caltechdata_write isn't idempotent, so a
+    # write is only retried when this is False
+    if production == True:
+        base_url = "https://authors.library.caltech.edu/"
+    else:
+        base_url = "https://authors.caltechlibrary.dev/"
+    if doi is not None and check_doi(doi, production=production, token=token):
+        return True
+    headers = {"Authorization": f"Bearer {token}"}
+    response = get_session().get(
+        f"{base_url}api/user/records",
+        params={"q": f"metadata.title:{_quote(title)}"},
+        headers=headers,
+    )
     if response.status_code != 200:
         raise Exception(response.text)
-    else:
-        metadata = response.json()
-        if metadata["hits"]["total"] > 0:
+    for hit in response.json()["hits"]["hits"]:
+        if hit["metadata"]["title"] == title:
             return True
-        else:
-            # Check queue
-
-            return False
+    response = get_session().get(
+        f"{base_url}api/requests/",
+        params={"q": f"title:{_quote(title)} AND is_open:true"},
+        headers=headers,
+    )
+    if response.status_code != 200:
+        raise Exception(response.text)
+    for hit in response.json()["hits"]["hits"]:
+        if hit["title"] == title:
+            return True
+    return False
 
 
 if __name__ == "__main__":
@@ -39,12 +103,14 @@ if __name__ == "__main__":
         description="check_doi queries the caltechDATA (Invenio 3) API\
     for a given DOI and returns whether it is present"
     )
-    parser.add_argument(
-        "doi",
-    )
+    parser.add_argument("doi", nargs="+")
     parser.add_argument("-test", dest="production", action="store_false")
 
     args = parser.parse_args()
 
     production = args.production
-    print(check_doi(args.doi, production))
+    if len(args.doi) == 1:
+        print(check_doi(args.doi[0], production))
+    else:
+        for doi, exists in check_dois(args.doi, production).items():
+            print(doi, exists)
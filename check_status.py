@@ -1,13 +1,16 @@
-import sys, json
+import sys
+from collections import Counter
+from results import read_results, FAILED
 
-print(sys.argv[1])
-result = json.loads(sys.argv[1])
+# Results can be a single JSONL file or a directory of downloaded artifacts
+counts = Counter()
+failed = False
+for result in read_results(sys.argv[1]):
+    counts[result["status"]] += 1
+    if result["status"] in FAILED:
+        print(f"{result['doi']}: {result['error_class']} {result['error']}")
+        failed = True
 
-errors = result["error"]
-
-for error in errors.keys():
-    e = errors[error]
-    if e:
-        if "system error" in e:
-            print(e)
-            exit(1)
+print(dict(counts))
+if failed:
+    exit(1)
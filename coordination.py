@@ -0,0 +1,166 @@
+import os
+import bisect
+import fcntl
+import hashlib
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring that assigns DOIs to workers.
+
+    Each worker gets several points on the ring, so adding or removing a
+    worker only moves the DOIs next to its points.
+    """
+
+    def __init__(self, workers, replicas=100):
+        self.ring = sorted(
+            (_hash(f"{worker}-{i}"), worker)
+            for worker in workers
+            for i in range(replicas)
+        )
+        self.points = [point for point, worker in self.ring]
+
+    def worker_for(self, doi):
+        position = bisect.bisect(self.points, _hash(doi.lower()))
+        return self.ring[position % len(self.ring)][1]
+
+
+def parse_shard(shard):
+    # "2/8" -> worker 2 of a ring with 8 workers
+    worker, total = (int(part) for part in shard.split("/"))
+    if not 0 <= worker < total:
+        # Otherwise no DOI would ever be assigned to this worker
+        raise ValueError(f"shard {shard} must be i/n with 0 <= i < n")
+    return worker, HashRing(range(total))
+
+
+class LeaseStore(ABC):
+    """Per-DOI leases shared between harvest workers.
+
+    Backends implement acquire, release, complete and is_completed.
+    """
+
+    @abstractmethod
+    def acquire(self, doi, owner, ttl):
+        pass
+
+    @abstractmethod
+    def release(self, doi, owner):
+        pass
+
+    @abstractmethod
+    def complete(self, doi, owner):
+        pass
+
+    @abstractmethod
+    def is_completed(self, doi):
+        pass
+
+
+class SQLiteLeaseStore(LeaseStore):
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as db:
+            db.execute(
+                """create table if not exists leases (
+                    doi text primary key,
+                    owner text,
+                    expires real,
+                    completed integer default 0
+                )"""
+            )
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def acquire(self, doi, owner, ttl):
+        db = self.connect()
+        try:
+            # An immediate transaction holds the write lock between the
+            # read and the write, so only one worker can win a lease
+            db.execute("begin immediate")
+            row = db.execute(
+                "select owner, expires, completed from leases where doi = ?",
+                (doi.lower(),),
+            ).fetchone()
+            now = time.time()
+            if row is not None:
+                current, expires, completed = row
+                if completed or (current != owner and expires > now):
+                    db.execute("rollback")
+                    return False
+            db.execute(
+                """insert or replace into leases (doi, owner, expires, completed)
+                values (?, ?, ?, 0)""",
+                (doi.lower(), owner, now + ttl),
+            )
+            db.execute("commit")
+            return True
+        finally:
+            db.close()
+
+    def release(self, doi, owner):
+        with self.connect() as db:
+            db.execute(
+                "delete from leases where doi = ? and owner = ? and completed = 0",
+                (doi.lower(), owner),
+            )
+
+    def complete(self, doi, owner):
+        with self.connect() as db:
+            db.execute(
+                "update leases set completed = 1 where doi = ? and owner = ?",
+                (doi.lower(), owner),
+            )
+
+    def is_completed(self, doi):
+        with self.connect() as db:
+            row = db.execute(
+                "select completed from leases where doi = ?", (doi.lower(),)
+            ).fetchone()
+        return bool(row and row[0])
+
+
+# Other backends can be registered here by URL scheme
+BACKENDS = {"sqlite": SQLiteLeaseStore}
+
+
+def get_lease_store(url):
+    # e.g. sqlite:///shared/leases.db
+    scheme, _, path = url.partition("://")
+    if scheme not in BACKENDS:
+        raise ValueError(f"unknown lease store backend: {scheme}")
+    return BACKENDS[scheme](path)
+
+
+def merge_harvested(dois, path="harvested_dois.txt"):
+    """Atomically merge DOIs into the harvested DOI file.
+
+    Holds an exclusive lock while reading and replacing the file, so
+    concurrent workers never lose each other's completions. Returns the
+    DOIs that were new.
+    """
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        existing = []
+        if os.path.exists(path):
+            with open(path) as infile:
+                existing = infile.read().splitlines()
+        seen = set(existing)
+        new = []
+        for doi in dois:
+            if doi not in seen:
+                seen.add(doi)
+                new.append(doi)
+        if new:
+            tmp = path + ".tmp"
+            with open(tmp, "w") as outfile:
+                outfile.write("".join(f"{doi}\n" for doi in existing + new))
+            os.replace(tmp, path)
+        return new
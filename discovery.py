@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from traceback import format_exc
+
+from idutils import normalize_doi
+from utils import format_error
+
+
+def merge_sources(fetchers, harvested_dois=()):
+    """Run DOI fetchers concurrently and merge their results.
+
+    fetchers maps a source name to a callable returning a list of DOIs.
+    Returns a dict of unique, unharvested DOIs to the sources that found them.
+    """
+    harvested = {doi.lower() for doi in harvested_dois}
+    merged = {}
+    seen = {}
+    with ThreadPoolExecutor(max_workers=len(fetchers)) as executor:
+        futures = {executor.submit(fetch): name for name, fetch in fetchers.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                dois = future.result()
+            except Exception as e:
+                cleaned = format_error(format_exc())
+                print(f"error= system error with {name} harvest {cleaned}")
+                continue
+            for doi in dois:
+                doi = normalize_doi(doi)
+                key = doi.lower()
+                if key in harvested:
+                    continue
+                if key not in seen:
+                    seen[key] = doi
+                    merged[doi] = []
+                sources = merged[seen[key]]
+                if name not in sources:
+                    sources.append(name)
+    return merged
@@ -0,0 +1,78 @@
+import copy
+import hashlib
+import json
+
+
+# Metadata fields that Dimensions enrichment and cleanup can change
+ENRICHED_METADATA = ["creators", "description"]
+# Identifier schemes Dimensions adds, merged into the curated identifiers
+ENRICHED_SCHEMES = {"pmid", "pmcid"}
+ENRICHED_CUSTOM_FIELDS = ["caltech:groups"]
+
+
+def _sorted_identifiers(identifiers):
+    return sorted(
+        {
+            (i.get("scheme", "").lower(), str(i.get("identifier", "")).strip().lower())
+            for i in identifiers
+        }
+    )
+
+
+def _normalize_creator(creator):
+    person = creator.get("person_or_org", {})
+    affiliations = sorted(
+        {
+            (a.get("id", ""), a.get("name", "").strip())
+            for a in creator.get("affiliations", [])
+        }
+    )
+    return {
+        "name": person.get("name", person.get("family_name", "")),
+        "identifiers": _sorted_identifiers(person.get("identifiers", [])),
+        "affiliations": affiliations,
+    }
+
+
+def enrichment_fields(record):
+    # Pull out and normalize the enrichment relevant parts of a record
+    metadata = record.get("metadata", {})
+    custom_fields = record.get("custom_fields", {})
+    description = metadata.get("description") or ""
+    groups = sorted(g["id"] for g in custom_fields.get("caltech:groups", []))
+    return {
+        "creators": [_normalize_creator(c) for c in metadata.get("creators", [])],
+        "identifiers": _sorted_identifiers(metadata.get("identifiers", [])),
+        "description": " ".join(description.split()),
+        "groups": groups,
+    }
+
+
+def fingerprint(record):
+    fields = json.dumps(enrichment_fields(record), sort_keys=True)
+    return hashlib.sha256(fields.encode("utf-8")).hexdigest()
+
+
+def apply_enrichment(record, enriched):
+    # Copy only the enrichment relevant fields onto an existing record, so
+    # rights, versions and other curated fields are left alone
+    record = copy.deepcopy(record)
+    for field in ENRICHED_METADATA:
+        if enriched["metadata"].get(field) is not None:
+            record["metadata"][field] = enriched["metadata"][field]
+    # Cleanup drops ISSNs, so identifiers are merged rather than copied
+    identifiers = record["metadata"].get("identifiers", [])
+    existing = {(i["scheme"], i["identifier"]) for i in identifiers}
+    for identifier in enriched["metadata"].get("identifiers", []):
+        key = (identifier["scheme"], identifier["identifier"])
+        if identifier["scheme"] in ENRICHED_SCHEMES and key not in existing:
+            identifiers.append(identifier)
+            existing.add(key)
+    if identifiers:
+        record["metadata"]["identifiers"] = identifiers
+    if "custom_fields" not in record:
+        record["custom_fields"] = {}
+    for field in ENRICHED_CUSTOM_FIELDS:
+        if field in enriched.get("custom_fields", {}):
+            record["custom_fields"][field] = enriched["custom_fields"][field]
+    return record
@@ -1,30 +1,57 @@
 import os, csv, json
+import copy
 import argparse
 import datetime
+import socket
 import subprocess
-import requests
+import time
 import dimcli
 from pathlib import Path
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from idutils import normalize_doi, normalize_orcid
-from check_doi import check_doi
+from check_doi import check_dois, check_written, BATCH_SIZE
 from caltechdata_api import caltechdata_write, caltechdata_edit
 from wos import get_wos_dois
 from traceback import format_exc
 from utils import format_error
+from sessions import get_session
+from limiter import get_limiter
+from spool import append_spool, read_spool
+from fingerprint import fingerprint, apply_enrichment
+from discovery import merge_sources
+from licenses import lookup_license, write_unmatched_report
+from coordination import parse_shard, get_lease_store, merge_harvested
+from results import ResultSink
+from retry_queue import RetryQueue
+from ror_index import ensure_index, lookup_external_id, match_affiliation
+from tracing import span, current_span
+from transform_cache import TransformCache
+from preflight import preflight, EXCLUDED_TYPES
 
 
+@lru_cache(maxsize=None)
 def grid_to_ror(grid):
+    with span("grid_to_ror", grid=grid) as s:
+        ror = _grid_to_ror(grid)
+        s.set_attribute("ror", ror)
+    return ror
+
+
+def _grid_to_ror(grid):
     if grid == "grid.451078.f":
         ror = "00hm6j694"
     elif grid == "grid.5805.8":
         ror = "02en5vm52"
     elif grid == "grid.465477.3":
         ror = "00em52312"
+    elif ensure_index():
+        ror = lookup_external_id("grid", grid)
     else:
         url = (
             f"https://api.ror.org/organizations?query.advanced=external_ids.all:{grid}"
         )
-        results = requests.get(url).json()
+        results = get_session().get(url).json()
         if len(results["items"]) == 0:
             ror = None
         else:
@@ -40,7 +67,9 @@ def match_orcid(creator, orcid, production=True):
     else:
         base_url = "https://authors.library.caltech.edu/"
     url = f"{base_url}api/names?q=identifiers.identifier:{orcid}"
-    response = requests.get(url)
+    with span("match_orcid", orcid=orcid) as s:
+        response = get_session().get(url)
+        s.set_attribute("http.status_code", response.status_code)
     if response.status_code == 200:
         results = response.json()["hits"]["hits"]
         if len(results) == 1:
@@ -52,38 +81,58 @@ def match_orcid(creator, orcid, production=True):
             person["identifiers"] = result["identifiers"]
 
 
-def add_dimensions_metadata(metadata, doi, review_message):
+DIMENSIONS_HOST = "cris-api.dimensions.ai"
+
+
+@lru_cache(maxsize=None)
+def get_dsl():
+    # Log in to Dimensions once per process
     dimkey = os.getenv("DIMKEY")
     endpoint = "https://cris-api.dimensions.ai/v3"
     dimcli.login(key=dimkey, endpoint=endpoint, verbose=False)
-    dsl = dimcli.Dsl()
-    res = dsl.query_iterative(
-        f"""
-        search publications
-        where doi = "{doi}"
-        return publications[basics+extras+abstract] """,
-        verbose=False,
-    )
+    return dimcli.Dsl()
+
+
+def add_dimensions_metadata(metadata, doi, review_message, match_names=True):
+    dsl = get_dsl()
+    with span("dimensions_query", doi=doi):
+        with get_limiter().host(DIMENSIONS_HOST).track():
+            res = dsl.query_iterative(
+                f"""
+                search publications
+                where doi = "{doi}"
+                return publications[basics+extras+abstract] """,
+                verbose=False,
+            )
     publication = res.json["publications"]
     if len(publication) == 0:
         # Not yet in dimensions
         return metadata, review_message
-    else:
-        publication = publication[0]
+    with span("dimensions_merge") as s:
+        s.set_attribute("authors", len(metadata["metadata"]["creators"]))
+        s.set_attribute("dimensions.authors", len(publication[0]["authors"]))
+        return merge_dimensions_metadata(
+            metadata, publication[0], review_message, match_names
+        )
+
+
+def merge_dimensions_metadata(
+    metadata, publication, review_message, match_names=True
+):
     if "description" not in metadata["metadata"]:
         metadata["metadata"]["description"] = publication.get("abstract")
     if "pmcid" in publication:
         if "identifiers" not in metadata["metadata"]:
             metadata["metadata"]["identifiers"] = []
-        metadata["metadata"]["identifiers"].append(
-            {"scheme": "pmcid", "identifier": publication["pmcid"]}
-        )
+        identifier = {"scheme": "pmcid", "identifier": publication["pmcid"]}
+        if identifier not in metadata["metadata"]["identifiers"]:
+            metadata["metadata"]["identifiers"].append(identifier)
     if "pmid" in publication:
         if "identifiers" not in metadata["metadata"]:
             metadata["metadata"]["identifiers"] = []
-        metadata["metadata"]["identifiers"].append(
-            {"scheme": "pmid", "identifier": publication["pmid"]}
-        )
+        identifier = {"scheme": "pmid", "identifier": publication["pmid"]}
+        if identifier not in metadata["metadata"]["identifiers"]:
+            metadata["metadata"]["identifiers"].append(identifier)
     dimensions_authors = publication["authors"]
     existing_authors = metadata["metadata"]["creators"]
     add_affil = True
@@ -146,6 +195,15 @@ def add_dimensions_metadata(metadata, doi, review_message):
                                 affil["id"] = "027k65916"
                             if "JPL" in raw:
                                 affil["id"] = "027k65916"
+                            # Name matches need a curator to confirm them
+                            if "id" not in affil and match_names and ensure_index():
+                                ror = match_affiliation(raw)
+                                if ror is not None:
+                                    affil["id"] = ror
+                                    review_message = (
+                                        review_message
+                                        + f"\n\n ROR {ror} matched by name only, please confirm: {raw}"
+                                    )
                         if affil not in affiliations:
                             affiliations.append(affil)
                     existing_authors[position_in_crossref][
@@ -155,13 +213,14 @@ def add_dimensions_metadata(metadata, doi, review_message):
     return metadata, review_message
 
 
-def cleanup_metadata(metadata, production=True):
-    # Read in groups list
+@lru_cache(maxsize=None)
+def load_people_data():
+    # Read the group and people crosswalks once per process
     groups_list = {}
     clpid_list = {}
     # Read in group list
     group_url = "https://feeds.library.caltech.edu/rpt/group_people_crosswalk.csv"
-    with requests.get(group_url, stream=True) as r:
+    with get_session().get(group_url, stream=True) as r:
         lines = (line.decode("utf-8") for line in r.iter_lines())
         for row in csv.DictReader(lines):
             clpid_list[row["orcid"]] = row["clpid"]
@@ -172,7 +231,7 @@ def cleanup_metadata(metadata, production=True):
     # Read in people list
     orcid_mapping = {}
     people_url = "https://feeds.library.caltech.edu/people/people.csv"
-    with requests.get(people_url, stream=True) as r:
+    with get_session().get(people_url, stream=True) as r:
         lines = (line.decode("utf-8") for line in r.iter_lines())
         for row in csv.DictReader(lines):
             if row["orcid"] != "":
@@ -181,6 +240,11 @@ def cleanup_metadata(metadata, production=True):
                     "caltech": row["caltech"],
                     "jpl": row["jpl"],
                 }
+    return groups_list, orcid_mapping
+
+
+def cleanup_metadata(metadata, production=True):
+    groups_list, orcid_mapping = load_people_data()
     # Match creators by ORCID
     groups = set()
     for creator in metadata["metadata"]["creators"]:
@@ -227,11 +291,6 @@ def cleanup_metadata(metadata, production=True):
             g_list.append({"id": group})
         metadata["custom_fields"]["caltech:groups"] = g_list
     # Clean up licenses
-    licenses = {}
-    with open("licenses.csv") as infile:
-        reader = csv.DictReader(infile, delimiter=",")
-        for row in reader:
-            licenses[row["props__url"]] = row["id"]
     rights = []
     files = None
     if "rights" in metadata["metadata"]:
@@ -239,12 +298,12 @@ def cleanup_metadata(metadata, production=True):
             if "link" in f:
                 link = f["link"]
                 # We need to have a license known to RDM
-                if link in licenses:
-                    license_id = licenses[link]
+                license_id = lookup_license(link)
+                if license_id is not None:
                     rights.append({"id": license_id})
                     if f["description"]["en"] == "vor":
                         doi = metadata["pids"]["doi"]["identifier"]
-                        response = requests.get("https://api.crossref.org/works/" + doi)
+                        response = get_session().get("https://api.crossref.org/works/" + doi)
                         if response.status_code == 200:
                             data = response.json()
                             try:
@@ -252,8 +311,18 @@ def cleanup_metadata(metadata, production=True):
                                 for link in links:
                                     if link["content-type"] == "application/pdf":
                                         link = link["URL"]
-                                        response = requests.get(link)
-                                        content_type = r.headers.get("Content-Type", "")
+                                        with span("pdf_download", url=link) as s:
+                                            response = get_session().get(link)
+                                            s.set_attribute(
+                                                "http.status_code",
+                                                response.status_code,
+                                            )
+                                            s.set_attribute(
+                                                "bytes", len(response.content)
+                                            )
+                                        content_type = response.headers.get(
+                                            "Content-Type", ""
+                                        )
                                         if "application/pdf" in content_type:
                                             fname = f"{doi.replace('/','_')}.pdf"
                                             filename = Path(fname)
@@ -284,7 +353,7 @@ def cleanup_metadata(metadata, production=True):
 def get_orcid_works(orcid):
     orcid_link = "https://orcid.org/"
     headers = {"Accept": "application/json"}
-    result = requests.get(orcid_link + orcid, headers=headers).json()
+    result = get_session().get(orcid_link + orcid, headers=headers).json()
     raw_works = result["activities-summary"]["works"]["group"]
     dois = []
     for work in raw_works:
@@ -295,7 +364,9 @@ def get_orcid_works(orcid):
     return dois
 
 
-def get_crossref_ror():
+def get_crossref_ror(last_run=None, until=None, date_type="index"):
+    # Without an explicit date the harvest runs from and updates last_run.txt.
+    # date_type selects the Crossref date filter, e.g. index or pub
     # Get defaults from environment variables if available
     ror = os.getenv("ROR")
     if ror is None:
@@ -305,47 +376,57 @@ def get_crossref_ror():
         email = "library@caltech.edu"
 
     # Get when the harvest was last run
-    with open("last_run.txt") as infile:
-        last_run = infile.read().strip("\n")
-
-    crossref_path = f"http://api.crossref.org/works?filter=ror-id:{ror},from-index-date:{last_run}&mailto={email}&rows=1000"
+    update_last_run = last_run is None
+    if update_last_run:
+        with open("last_run.txt") as infile:
+            last_run = infile.read().strip("\n")
 
-    excluded = ["peer-review", "grant", "dataset"]
+    filters = f"ror-id:{ror},from-{date_type}-date:{last_run}"
+    if until is not None:
+        filters += f",until-{date_type}-date:{until}"
+    crossref_path = f"http://api.crossref.org/works?filter={filters}&mailto={email}&rows=1000"
 
-    # Get the list of DOIs from Crossref
-    response = requests.get(crossref_path)
-    data = response.json()
+    # Get the list of DOIs from Crossref, following the cursor past the
+    # first 1000 results
     dois = []
-    if "items" in data["message"]:
-        for result in data["message"]["items"]:
-            if result["type"] not in excluded:
+    cursor = "*"
+    while cursor:
+        response = get_session().get(crossref_path, params={"cursor": cursor})
+        data = response.json()
+        items = data["message"].get("items", [])
+        for result in items:
+            if result["type"] not in EXCLUDED_TYPES:
                 dois.append(result["DOI"])
+        cursor = data["message"].get("next-cursor") if items else None
 
-    date = datetime.date.today().isoformat()
-    with open("last_run.txt", "w") as outfile:
-        outfile.write(date)
+    if update_last_run:
+        date = datetime.date.today().isoformat()
+        with open("last_run.txt", "w") as outfile:
+            outfile.write(date)
 
     return dois
 
 
-def get_dimensions():
-    key = os.getenv("DIMKEY")
-
-    date = (datetime.date.today() - datetime.timedelta(days=7)).isoformat()
+def get_dimensions(since=None, until=None):
+    # Defaults to publications from the last week
+    if since is None:
+        since = (datetime.date.today() - datetime.timedelta(days=7)).isoformat()
+    dates = f'date >= "{since}"'
+    if until is not None:
+        dates += f' and date <= "{until}"'
     dois = []
 
-    endpoint = "https://cris-api.dimensions.ai/v3"
-    dimcli.login(key=key, endpoint=endpoint, verbose=False)
-    dsl = dimcli.Dsl()
-
-    res = dsl.query_iterative(
-        f"""
-        search publications
-        where research_orgs.id = "grid.20861.3d"
-        and date >= "{date}"
-        return publications[basics+extras] """,
-        verbose=False,
-    )
+    dsl = get_dsl()
+
+    with get_limiter().host(DIMENSIONS_HOST).track():
+        res = dsl.query_iterative(
+            f"""
+            search publications
+            where research_orgs.id = "grid.20861.3d"
+            and {dates}
+            return publications[basics+extras] """,
+            verbose=False,
+        )
 
     publications = res.json["publications"]
     for publication in publications:
@@ -431,7 +512,7 @@ def check_record(data, review_message, token, production=True):
         base_url = "https://authors.caltechlibrary.dev/"
     else:
         base_url = "https://authors.library.caltech.edu/"
-    result = requests.get(f'{base_url}api/records?q=metadata.title:"{title}"')
+    result = get_session().get(f'{base_url}api/records?q=metadata.title:"{title}"')
     if result.status_code == 200:
         result = result.json()
         if result["hits"]["total"] > 0:
@@ -440,7 +521,7 @@ def check_record(data, review_message, token, production=True):
                 link = possible_match["links"]["self_html"]
                 review_message += f"\n\n  ❗❗❗ Duplicate title found: {link}"
     headers = {"Authorization": f"Bearer {token}"}
-    result = requests.get(
+    result = get_session().get(
         headers=headers,
         url=f'{base_url}api/requests/?q=title:"{title}"%20AND%20is_open:true',
     )
@@ -456,12 +537,287 @@ def check_record(data, review_message, token, production=True):
     return review_message
 
 
+def run_doi2rdm(doi, cache=None):
+    # With a cache, a DOI already transformed with the current options.yaml
+    # isn't transformed again
+    if cache is not None:
+        data = cache.load(doi)
+        current_span().set_attribute("cache", "miss" if data is None else "hit")
+        if data is not None:
+            return data
+    output = subprocess.check_output(["doi2rdm", "options.yaml", doi])
+    data = json.loads(output.decode("utf-8"))
+    if not isinstance(data, dict) or "metadata" not in data:
+        raise ValueError(f"doi2rdm output for {doi} has no metadata")
+    if cache is not None:
+        cache.store(doi, output)
+    return data
+
+
+def transform_doi(
+    doi, review_message, token, production=True, outcome=None, cache=None
+):
+    # Run doi2rdm and all enrichment for a DOI. Returns the record, review
+    # message and files, or None after printing an error. Stage timings and
+    # errors are recorded in outcome
+    if outcome is None:
+        outcome = {}
+    timings = outcome.setdefault("timings", {})
+
+    def failed(stage, e, status="error"):
+        current_span().set_error(e)
+        if status == "not_found":
+            message = f"DOI {doi} not found in Crossref or DataCite"
+            print(f"error={message}")
+        else:
+            message = f"system error with {stage}"
+            cleaned = format_error(format_exc())
+            print(f"error= {message} {cleaned}")
+        outcome["status"] = status
+        outcome["error"] = f"{message}: {e}"
+        outcome["error_class"] = type(e).__name__
+        return None
+
+    start = time.perf_counter()
+    with span("doi2rdm", doi=doi) as s:
+        try:
+            data = run_doi2rdm(doi, cache=cache)
+            s.set_attribute("authors", len(data["metadata"].get("creators", [])))
+        except subprocess.CalledProcessError as e:
+            if e.returncode == 2:
+                return failed("doi2rdm", e, status="not_found")
+            return failed("doi2rdm", e)
+        except Exception as e:
+            # Output that isn't a record only fails this DOI
+            return failed("doi2rdm", e)
+        finally:
+            timings["doi2rdm"] = time.perf_counter() - start
+    start = time.perf_counter()
+    with span("check_record"):
+        try:
+            review_message = check_record(
+                data, review_message, token, production=production
+            )
+        except Exception as e:
+            return failed("record checking", e)
+        finally:
+            timings["check_record"] = time.perf_counter() - start
+    start = time.perf_counter()
+    with span("dimensions"):
+        try:
+            data, review_message = add_dimensions_metadata(data, doi, review_message)
+        except Exception as e:
+            return failed("Dimensions metadata", e)
+        finally:
+            timings["dimensions"] = time.perf_counter() - start
+    start = time.perf_counter()
+    with span("cleanup"):
+        try:
+            data, files = cleanup_metadata(data)
+        except Exception as e:
+            return failed("metadata cleanup", e)
+        finally:
+            timings["cleanup"] = time.perf_counter() - start
+    return data, review_message, files
+
+
+def write_record(
+    data, token, production, community, review_message, files, publish=False
+):
+    if production == False:
+        host = "authors.caltechlibrary.dev"
+    else:
+        host = "authors.library.caltech.edu"
+    # The write holds a slot in the host's window but, being many requests
+    # made by caltechdata_api, doesn't adjust it
+    with span("caltechdata_write", files=files), get_limiter().host(host).track():
+        return caltechdata_write(
+            data,
+            token,
+            production=production,
+            authors=True,
+            community=community,
+            review_message=review_message,
+            files=files,
+            publish=publish,
+        )
+
+
+def publish_spool(
+    spool,
+    token,
+    production,
+    community,
+    harvested_dois,
+    publish=False,
+    workers=4,
+    retries=3,
+    write_local=False,
+    sink=None,
+):
+    # Write staged records to CaltechAUTHORS. Records that are already
+    # harvested or present in the repository are skipped, so a spool can
+    # be replayed safely after a partial failure
+    if sink is None:
+        sink = ResultSink()
+    # Staging overlapping lists leaves several entries for a DOI, and only
+    # the last one is published
+    last = {}
+    for position, entry in enumerate(read_spool(spool)):
+        last[entry["doi"].lower()] = (position, entry["doi"])
+    existing = check_dois(
+        [doi for position, doi in last.values() if doi not in harvested_dois],
+        production=production,
+        token=token,
+    )
+    entries = (
+        entry
+        for position, entry in enumerate(read_spool(spool))
+        if last[entry["doi"].lower()][0] == position
+    )
+
+    def written(title, doi):
+        try:
+            return check_written(title, doi, production=production, token=token)
+        except Exception:
+            # Without an answer a retry could make a duplicate
+            return True
+
+    def publish_entry(entry):
+        doi = entry["doi"]
+        if doi in harvested_dois:
+            message = f"DOI {doi} is already in CaltechAUTHORS, skipping"
+            return doi, "skipped", message, None, None, {}
+        if existing.get(doi):
+            message = f"DOI {doi} has already been harvested, skipping"
+            return doi, "skipped", message, None, None, {}
+        start = time.perf_counter()
+        title = entry["record"]["metadata"]["title"]
+        for attempt in range(retries + 1):
+            if attempt > 0 and written(title, doi):
+                print(
+                    f"error= DOI {doi} may have been partly written before an error, check drafts and the review queue"
+                )
+                message = f"may have been partly written before {error_class}, not retried"
+                timings = {"write": time.perf_counter() - start}
+                return doi, "error", message, error_class, None, timings
+            try:
+                record_id = write_record(
+                    entry["record"],
+                    token,
+                    production,
+                    community,
+                    entry["review_message"],
+                    entry["files"],
+                    publish=publish,
+                )
+                timings = {"write": time.perf_counter() - start}
+                return doi, "harvested", None, None, record_id, timings
+            except Exception as e:
+                error_class = type(e).__name__
+                if attempt == retries:
+                    cleaned = format_error(format_exc())
+                    print(
+                        f"error= system error with writing metadata to CaltechAUTHORS {cleaned}"
+                    )
+                    message = f"system error with writing metadata to CaltechAUTHORS: {e}"
+                    timings = {"write": time.perf_counter() - start}
+                    return doi, "error", message, error_class, None, timings
+                time.sleep(2**attempt)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(publish_entry, entries):
+            doi, status, message, error_class, record_id, timings = result
+            if status == "harvested":
+                harvested_dois.add(doi)
+                print("doi=", doi)
+                if write_local:
+                    merge_harvested([doi])
+            elif status == "skipped":
+                print(f"error={message}")
+            sink.write(
+                doi,
+                status,
+                timings=timings,
+                error=message,
+                error_class=error_class,
+                record_id=record_id,
+            )
+
+
+def defer_doi(retry_queue, doi, error, review_message):
+    if retry_queue.defer(doi, error, review_message):
+        print(f"deferred={doi}")
+    else:
+        print(f"dead_letter={doi}")
+
+
+def get_recent_records(days, production=True):
+    # Yield CaltechAUTHORS records created in the last number of days
+    if production == False:
+        base_url = "https://authors.caltechlibrary.dev/"
+    else:
+        base_url = "https://authors.library.caltech.edu/"
+    date = (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+    url = f"{base_url}api/records?q=created:[{date} TO *]&sort=newest&size=100"
+    while url:
+        response = get_session().get(url)
+        if response.status_code != 200:
+            raise Exception(response.text)
+        data = response.json()
+        for record in data["hits"]["hits"]:
+            yield record
+        url = data["links"].get("next")
+
+
+def update_record(record, token, production=True, publish=False):
+    # Re-run Dimensions enrichment and cleanup on an existing record and
+    # only send an edit when the enrichment fingerprint changes. Edits stay
+    # drafts unless publish is set, and since the sweep runs unattended,
+    # affiliations are never matched by name only and review notes are
+    # printed for a curator
+    doi = record.get("pids", {}).get("doi", {}).get("identifier")
+    if doi is None:
+        return False
+    enriched = {
+        "metadata": copy.deepcopy(record["metadata"]),
+        "custom_fields": copy.deepcopy(record.get("custom_fields", {})),
+        "pids": record["pids"],
+    }
+    # Rights are already curated on existing records
+    enriched["metadata"].pop("rights", None)
+    enriched, review_message = add_dimensions_metadata(
+        enriched, doi, "", match_names=False
+    )
+    enriched, files = cleanup_metadata(enriched, production=production)
+    updated = apply_enrichment(record, enriched)
+    if fingerprint(updated) == fingerprint(record):
+        return False
+    if review_message:
+        print(f"review={record['id']} {' '.join(review_message.split())}")
+    if production == False:
+        host = "authors.caltechlibrary.dev"
+    else:
+        host = "authors.library.caltech.edu"
+    with get_limiter().host(host).track():
+        caltechdata_edit(
+            record["id"],
+            updated,
+            token,
+            production=production,
+            authors=True,
+            publish=publish,
+        )
+    return True
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Harvest DOIs from Crossref or ORCID and add to CaltechAUTHORS"
     )
     parser.add_argument(
-        "harvest_type", help="crossref, orcid, doi, wos, dimensions, authors"
+        "harvest_type",
+        help="crossref, orcid, doi, doi_list, wos, dimensions, merge, authors, publish, update, retry",
     )
     parser.add_argument("-orcid", help="ORCID ID to harvest from")
     parser.add_argument("-doi", help="DOI to harvest")
@@ -485,6 +841,69 @@ if __name__ == "__main__":
         help="Write DOIs to local file (not using a GitHub workflow)",
         action="store_true",
     )
+    parser.add_argument(
+        "-stage",
+        help="Write enriched records to the spool instead of CaltechAUTHORS",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-spool",
+        help="Compressed JSONL spool for staged records",
+        default="spool.jsonl.gz",
+    )
+    parser.add_argument(
+        "-workers", help="Concurrent writers when publishing", type=int, default=4
+    )
+    parser.add_argument(
+        "-retries", help="Write retries when publishing", type=int, default=3
+    )
+    parser.add_argument(
+        "-days",
+        help="Re-enrich records created in the last number of days",
+        type=int,
+        default=7,
+    )
+    parser.add_argument(
+        "-sources",
+        help="Comma separated sources for a merge harvest (crossref,dimensions,wos,orcid)",
+        default="crossref,dimensions",
+    )
+    parser.add_argument(
+        "-wos-period", help="Web of Science load time span for a merge", default="5D"
+    )
+    parser.add_argument(
+        "-shard", help="Only harvest DOIs assigned to worker i of n (i/n)"
+    )
+    parser.add_argument(
+        "-lease-store",
+        help="Shared DOI lease store, e.g. sqlite:///shared/leases.db",
+    )
+    parser.add_argument(
+        "-lease-ttl", help="Seconds before a DOI lease expires", type=int, default=3600
+    )
+    parser.add_argument(
+        "-results", help="Append one JSON result per DOI to this JSONL file"
+    )
+    parser.add_argument(
+        "-retry-queue",
+        help="Defer failed DOIs to this queue file and retry them when due",
+    )
+    parser.add_argument(
+        "-max-attempts",
+        help="Attempts before a deferred DOI goes to the dead letter list",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "-skip-preprints",
+        help="Don't harvest preprints (posted content and arXiv DOIs)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-no-cache",
+        help="Always run doi2rdm instead of using cached transformations",
+        action="store_true",
+    )
     args = parser.parse_args()
 
     if args.test:
@@ -498,7 +917,7 @@ if __name__ == "__main__":
 
     # Get DOIs that have already been harvested
     with open("harvested_dois.txt") as infile:
-        harvested_dois = infile.read().splitlines()
+        harvested_dois = set(infile.read().splitlines())
 
     if production:
         community = "aedd135f-227e-4fdf-9476-5b3fd011bac6"
@@ -516,6 +935,8 @@ if __name__ == "__main__":
     else:
         tag = ""
 
+    doi_sources = {}
+
     if harvest_type == "crossref":
         dois = get_crossref_ror()
         if args.message:
@@ -538,13 +959,13 @@ if __name__ == "__main__":
         if args.authors_source and args.authors_destination:
             source = args.authors_source
             destination = args.authors_destination
-            response = requests.get(f"{base_url}api/records/{source}")
+            response = get_session().get(f"{base_url}api/records/{source}")
             if response.status_code == 200:
                 source_record = response.json()
             else:
                 print(f"error=source record {source} not found")
                 exit()
-            response = requests.get(f"{base_url}api/records/{destination}")
+            response = get_session().get(f"{base_url}api/records/{destination}")
             if response.status_code == 200:
                 destination_record = response.json()
             else:
@@ -567,6 +988,29 @@ if __name__ == "__main__":
         else:
             print(f"error=source and destination records must be provided")
             exit()
+    elif harvest_type == "merge":
+        fetchers = {
+            "crossref": get_crossref_ror,
+            "dimensions": get_dimensions,
+            "wos": lambda: get_wos_dois(args.wos_period),
+            "orcid": lambda: get_orcid_works(args.orcid),
+        }
+        sources = args.sources.split(",")
+        doi_sources = merge_sources(
+            {source: fetchers[source] for source in sources}, harvested_dois
+        )
+        dois = list(doi_sources)
+        if args.message:
+            review_start = args.message
+        else:
+            review_start = f"Automatically added from merged {', '.join(sources)} harvest. {tag}"
+        if args.print:
+            ostring = "dois="
+            for doi in dois:
+                ostring += f" {doi}"
+            print(ostring)
+            print(f"message= {review_start}")
+            dois = []
     elif harvest_type == "dimensions":
         dois = get_dimensions()
         if args.message:
@@ -616,93 +1060,227 @@ if __name__ == "__main__":
         dois, new_dois, existing_dois, arxiv_dois = read_outputs()
         count = 1
         while dois:
-            doi = dois.pop()
-            print(doi, len(dois))
+            # DOIs are only removed once their batch has been checked, so
+            # the outputs can be resumed after an error
+            batch = dois[-BATCH_SIZE:]
+            print(batch[-1], len(dois))
             try:
-                if not check_doi(doi, production=True, token=token):
-                    if "arXiv" in doi:
-                        arxiv_dois.append(doi)
-                    else:
-                        new_dois.append(doi)
-                else:
-                    existing_dois.append(doi)
+                existing = check_dois(batch, production=True, token=token)
             except Exception as e:
                 print(e)
                 if args.report:
                     print(count)
                     write_outputs(dois, new_dois, existing_dois, arxiv_dois)
                 exit()
-            count += 1
+            for doi in reversed(batch):
+                if not existing[doi]:
+                    if "arXiv" in doi:
+                        arxiv_dois.append(doi)
+                    else:
+                        new_dois.append(doi)
+                else:
+                    existing_dois.append(doi)
+                count += 1
+            del dois[-len(batch) :]
         print(count)
         write_outputs(dois, new_dois, existing_dois, arxiv_dois)
+    elif harvest_type == "publish":
+        dois = []
+    elif harvest_type == "retry":
+        # Only the due DOIs from the retry queue are harvested
+        dois = []
+        if args.message:
+            review_start = args.message
+        else:
+            review_start = f"Automatically added from the deferred DOI queue. {tag}"
+    elif harvest_type == "update":
+        dois = []
+        checked = 0
+        updated = 0
+        for record in get_recent_records(args.days, production=production):
+            checked += 1
+            try:
+                if update_record(
+                    record, token, production=production, publish=args.publish
+                ):
+                    updated += 1
+                    print(f"updated={record['id']}")
+            except Exception as e:
+                cleaned = format_error(format_exc())
+                print(f"error= system error updating {record['id']} {cleaned}")
+        print(f"Updated {updated} of {checked} records")
     else:
         print("error: system error invalid harvest type")
 
+    sink = ResultSink(args.results)
+
+    transform_cache = None
+    if not args.no_cache:
+        transform_cache = TransformCache()
+
+    retry_queue = None
+    deferred_messages = {}
+    if args.retry_queue:
+        retry_queue = RetryQueue(args.retry_queue, max_attempts=args.max_attempts)
+        deferred_messages = retry_queue.due()
+        # Deferred DOIs that are due go ahead of this run's DOIs
+        dois = list(deferred_messages) + [
+            doi for doi in dois if doi not in deferred_messages
+        ]
+
+    if harvest_type == "publish":
+        if args.publish:
+            publish = True
+        else:
+            publish = False
+        publish_spool(
+            args.spool,
+            token,
+            production,
+            community,
+            harvested_dois,
+            publish=publish,
+            workers=args.workers,
+            retries=args.retries,
+            write_local=args.write_local,
+            sink=sink,
+        )
+
+    ring = None
+    if args.shard:
+        worker, ring = parse_shard(args.shard)
+    leases = None
+    if args.lease_store:
+        leases = get_lease_store(args.lease_store)
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    dois = list(dict.fromkeys(normalize_doi(doi) for doi in dois))
+    if ring is not None:
+        # Other shards own the rest
+        dois = [doi for doi in dois if ring.worker_for(doi) == worker]
+    # Resolve type, registration agency and harvested status for every DOI
+    # in bulk, so ineligible DOIs never reach the per-DOI pipeline
+    checked = preflight(
+        dois,
+        harvested_dois,
+        production=production,
+        token=token,
+        skip_preprints=args.skip_preprints,
+    )
+
     for doi in dois:
-        doi = normalize_doi(doi)
-        review_message = review_start
-        if doi not in harvested_dois:
-            if not check_doi(doi, production=production, token=token):
-                try:
-                    transformed = subprocess.check_output(
-                        ["doi2rdm", "options.yaml", doi]
-                    )
-                    data = transformed.decode("utf-8")
-                    data = json.loads(data)
-                except subprocess.CalledProcessError as e:
-                    if e.returncode == 2:
-                        print(f"error=DOI {doi} not found in Crossref or DataCite")
-                    else:
-                        cleaned = format_error(format_exc())
-                        print(f"error= system error with doi2rdm {cleaned}")
-                    break
-                try:
-                    review_message = check_record(
-                        data, review_message, token, production=production
-                    )
-                except Exception as e:
-                    cleaned = format_error(format_exc())
-                    print(f"error= system error with record checking {cleaned}")
-                    break
-                try:
-                    data, review_message = add_dimensions_metadata(
-                        data, doi, review_message
-                    )
-                except Exception as e:
-                    cleaned = format_error(format_exc())
-                    print(f"error= system error with Dimensions metadata {cleaned}")
-                    break
-                try:
-                    data, files = cleanup_metadata(data)
-                except Exception as e:
-                    cleaned = format_error(format_exc())
-                    print(f"error= system error with metadata cleanup {cleaned}")
-                    break
-                try:
-                    if args.publish:
-                        publish = True
-                    else:
-                        publish = False
-                    response = caltechdata_write(
-                        data,
+        with span("harvest_doi", doi=doi, harvest_type=harvest_type):
+            review_message = deferred_messages.get(doi) or review_start
+            if doi in doi_sources:
+                review_message += f" Found by: {', '.join(doi_sources[doi])}."
+            if leases is not None and leases.is_completed(doi):
+                harvested_dois.add(doi)
+            if doi not in harvested_dois:
+                if not checked[doi]["harvested"]:
+                    if checked[doi]["reason"] is not None:
+                        message = f"DOI {doi} {checked[doi]['reason']}, skipping"
+                        print(f"error={message}")
+                        sink.write(doi, "skipped", error=message)
+                        if retry_queue is not None:
+                            retry_queue.done(doi)
+                        continue
+                    if leases is not None:
+                        if not leases.acquire(doi, owner, args.lease_ttl):
+                            message = (
+                                f"DOI {doi} is leased by another worker, skipping"
+                            )
+                            print(f"error={message}")
+                            sink.write(doi, "skipped", error=message)
+                            continue
+                    base_message = review_message
+                    outcome = {}
+                    result = transform_doi(
+                        doi,
+                        review_message,
                         token,
-                        production=production,
-                        authors=True,
-                        community=community,
-                        review_message=review_message,
-                        files=files,
-                        publish=publish,
-                    )
-                    print("doi=", doi)
-                    if args.write_local:
-                        with open("harvested_dois.txt", "a") as outfile:
-                            outfile.write(f"{doi}\n")
-                except Exception as e:
-                    cleaned = format_error(format_exc())
-                    print(
-                        f"error= system error with writing metadata to CaltechAUTHORS {cleaned}"
+                        production,
+                        outcome=outcome,
+                        cache=transform_cache,
                     )
+                    if result is None:
+                        if leases is not None:
+                            leases.release(doi, owner)
+                        sink.write(
+                            doi,
+                            outcome["status"],
+                            timings=outcome["timings"],
+                            error=outcome["error"],
+                            error_class=outcome["error_class"],
+                        )
+                        if retry_queue is not None:
+                            defer_doi(retry_queue, doi, outcome["error"], base_message)
+                        continue
+                    data, review_message, files = result
+                    if args.stage:
+                        append_spool(args.spool, doi, data, review_message, files)
+                        print(f"staged={doi}")
+                        sink.write(doi, "staged", timings=outcome["timings"])
+                        if retry_queue is not None:
+                            retry_queue.done(doi)
+                        if leases is not None:
+                            leases.release(doi, owner)
+                        continue
+                    start = time.perf_counter()
+                    try:
+                        if args.publish:
+                            publish = True
+                        else:
+                            publish = False
+                        record_id = write_record(
+                            data,
+                            token,
+                            production,
+                            community,
+                            review_message,
+                            files,
+                            publish=publish,
+                        )
+                        outcome["timings"]["write"] = time.perf_counter() - start
+                        print("doi=", doi)
+                        sink.write(
+                            doi,
+                            "harvested",
+                            timings=outcome["timings"],
+                            record_id=record_id,
+                        )
+                        if leases is not None:
+                            leases.complete(doi, owner)
+                        if retry_queue is not None:
+                            retry_queue.done(doi)
+                        if args.write_local:
+                            merge_harvested([doi])
+                    except Exception as e:
+                        outcome["timings"]["write"] = time.perf_counter() - start
+                        if leases is not None:
+                            leases.release(doi, owner)
+                        message = "system error with writing metadata to CaltechAUTHORS"
+                        cleaned = format_error(format_exc())
+                        print(f"error= {message} {cleaned}")
+                        sink.write(
+                            doi,
+                            "error",
+                            timings=outcome["timings"],
+                            error=f"{message}: {e}",
+                            error_class=type(e).__name__,
+                        )
+                        if retry_queue is not None:
+                            defer_doi(retry_queue, doi, f"{message}: {e}", base_message)
+                else:
+                    message = f"DOI {doi} has already been harvested, skipping"
+                    print(f"error={message}")
+                    sink.write(doi, "skipped", error=message)
+                    if retry_queue is not None:
+                        retry_queue.done(doi)
             else:
-                print(f"error=DOI {doi} has already been harvested, skipping")
-        else:
-            print(f"error=DOI {doi} is already in CaltechAUTHORS, skipping")
+                message = f"DOI {doi} is already in CaltechAUTHORS, skipping"
+                print(f"error={message}")
+                sink.write(doi, "skipped", error=message)
+                if retry_queue is not None:
+                    retry_queue.done(doi)
+
+    write_unmatched_report()
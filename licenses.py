@@ -0,0 +1,140 @@
+import os, csv
+import argparse
+import collections
+import pickle
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+LICENSE_FILE = "licenses.csv"
+CACHE_FILE = ".licenses.pickle"
+UNMATCHED_FILE = "unmatched_licenses.csv"
+
+# Host names publishers use interchangeably for the same license pages
+HOST_ALIASES = {
+    "creativecommons.net": "creativecommons.org",
+    "opensource.org/licenses": "opensource.org/license",
+}
+
+# Trailing path parts that point at a variant of the same license text
+SUFFIXES = re.compile(
+    r"/(legalcode|deed)(\.[a-z_-]+)?$|/(index\.(html?|php))$|\.(html?|php|txt)$"
+)
+
+# Creative Commons URLs are matched on their type/version prefix, so
+# jurisdiction ports and language variants fall back to the base license
+PREFIX_HOSTS = ["creativecommons.org"]
+
+unmatched = collections.Counter()
+
+
+def canonical_url(url):
+    # Reduce a license URL to a scheme, case and suffix independent form
+    url = url.strip().lower()
+    if "://" not in url:
+        url = "//" + url
+    parts = urlsplit(url)
+    host = parts.netloc.split("@")[-1].split(":")[0]
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    while True:
+        stripped = SUFFIXES.sub("", path).rstrip("/")
+        if stripped == path:
+            break
+        path = stripped
+    canonical = host + path
+    for alias, target in HOST_ALIASES.items():
+        if canonical.startswith(alias):
+            canonical = target + canonical[len(alias) :]
+    return canonical
+
+
+def build_license_index(path=LICENSE_FILE):
+    index = {}
+    with open(path) as infile:
+        reader = csv.DictReader(infile, delimiter=",")
+        for row in reader:
+            # Earlier rows win, matching the order of the CSV
+            index.setdefault(canonical_url(row["props__url"]), row["id"])
+    return index
+
+
+@lru_cache(maxsize=None)
+def load_license_index(path=LICENSE_FILE, cache=CACHE_FILE):
+    # Use the serialized index unless licenses.csv has changed since it
+    # was written
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    if os.path.exists(cache):
+        try:
+            with open(cache, "rb") as infile:
+                saved = pickle.load(infile)
+            if saved["key"] == key:
+                return saved["index"]
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+            pass
+    index = build_license_index(path)
+    try:
+        with open(cache, "wb") as outfile:
+            pickle.dump({"key": key, "index": index}, outfile)
+    except OSError:
+        pass
+    return index
+
+
+def lookup_license(url):
+    # Returns the RDM license id for a URL, or None if it is unknown
+    index = load_license_index()
+    canonical = canonical_url(url)
+    if canonical in index:
+        return index[canonical]
+    host, _, path = canonical.partition("/")
+    if host in PREFIX_HOSTS:
+        # Drop trailing path parts until a versioned license is left,
+        # e.g. licenses/by/4.0/de -> licenses/by/4.0
+        parts = path.split("/")
+        while len(parts) > 3:
+            parts.pop()
+            prefix = host + "/" + "/".join(parts)
+            if prefix in index:
+                return index[prefix]
+    unmatched[url] += 1
+    return None
+
+
+def write_unmatched_report(path=UNMATCHED_FILE):
+    # Merge this run's unmatched URLs into the running report
+    counts = collections.Counter()
+    if os.path.exists(path):
+        with open(path) as infile:
+            for row in csv.DictReader(infile):
+                counts[row["url"]] += int(row["count"])
+    counts.update(unmatched)
+    unmatched.clear()
+    if not counts:
+        return
+    with open(path, "w") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(["url", "count"])
+        for url, count in counts.most_common():
+            writer.writerow([url, count])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild the license index and show unmatched license URLs"
+    )
+    parser.add_argument("-url", help="License URL to look up")
+    args = parser.parse_args()
+
+    if os.path.exists(CACHE_FILE):
+        os.remove(CACHE_FILE)
+    index = load_license_index()
+    print(f"{len(index)} license URLs indexed")
+    if args.url:
+        print(lookup_license(args.url))
+    elif os.path.exists(UNMATCHED_FILE):
+        with open(UNMATCHED_FILE) as infile:
+            for row in csv.DictReader(infile):
+                print(f"{row['count']:>6} {row['url']}")
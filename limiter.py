@@ -0,0 +1,126 @@
+import os, json
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+
+LIMITS_FILE = "host_limits.json"
+
+# Responses that mean the host wants us to slow down
+THROTTLED = {429, 503}
+
+
+class HostLimiter:
+    """AIMD window of in-flight requests for one host.
+
+    The window grows by one request per window of fast successes and is
+    halved on a 429/503. Responses much slower than the best latency seen
+    so far shrink it gently, before the host starts refusing requests.
+    """
+
+    def __init__(self, limit=4.0, min_limit=1, max_limit=32):
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.latency = None
+        self.best_latency = None
+        self.blocked_until = 0.0
+        # Responses that have adjusted the window
+        self.samples = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            wait = self.blocked_until - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+    def release(self, latency, status=None, retry_after=None):
+        with self.condition:
+            self.in_flight -= 1
+            if status in THROTTLED or latency is not None:
+                self.samples += 1
+            if status in THROTTLED:
+                self.limit = max(self.min_limit, self.limit / 2)
+                delay = 1.0
+                if retry_after is not None:
+                    try:
+                        delay = float(retry_after)
+                    except ValueError:
+                        pass
+                self.blocked_until = max(self.blocked_until, time.time() + delay)
+            elif latency is not None:
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency = 0.8 * self.latency + 0.2 * latency
+                if self.best_latency is None or self.latency < self.best_latency:
+                    self.best_latency = self.latency
+                if self.latency > 3 * self.best_latency:
+                    self.limit = max(self.min_limit, self.limit * 0.9)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    @contextmanager
+    def track(self):
+        # For calls made by other libraries, which hold a slot in the window
+        # but don't adjust it. A whole write or query is many requests, so
+        # its duration says nothing about one request's latency
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release(None)
+
+
+class AdaptiveLimiter:
+    """Per-host limiters whose windows persist between runs."""
+
+    def __init__(self, path=LIMITS_FILE):
+        self.path = path
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.saved = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as infile:
+                    self.saved = json.load(infile)
+            except ValueError:
+                pass
+
+    def host(self, name):
+        with self.lock:
+            if name not in self.hosts:
+                self.hosts[name] = HostLimiter(limit=self.saved.get(name, 4.0))
+            return self.hosts[name]
+
+    def save(self):
+        with self.lock:
+            limits = dict(self.saved)
+            for name, limiter in self.hosts.items():
+                # Only windows learned from HTTP responses are kept
+                if limiter.samples:
+                    limits[name] = round(limiter.limit, 2)
+        try:
+            with open(self.path, "w") as outfile:
+                json.dump(limits, outfile, indent=2, sort_keys=True)
+        except OSError:
+            pass
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AdaptiveLimiter()
+            atexit.register(_limiter.save)
+        return _limiter
@@ -0,0 +1,208 @@
+import os, json
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from check_doi import check_dois
+from sessions import get_session
+
+# Crossref and registration agency facts, shared with split_doi.py
+CACHE_FILE = "preflight_cache.json"
+
+# Crossref work types that are never added to CaltechAUTHORS
+EXCLUDED_TYPES = {"peer-review", "grant", "dataset"}
+
+# Registration agencies doi2rdm can transform
+AGENCIES = {"Crossref", "DataCite"}
+
+# arXiv DOIs are registered with DataCite under this prefix
+ARXIV_PREFIX = "10.48550/"
+
+# DOIs per Crossref filter or doi.org RA query
+BATCH_SIZE = 50
+
+
+def load_cache(path=CACHE_FILE):
+    if os.path.exists(path):
+        try:
+            with open(path) as infile:
+                return json.load(infile)
+        except ValueError:
+            pass
+    return {}
+
+
+def save_cache(cache, path=CACHE_FILE):
+    # Shard workers can share a directory, so each writes its own temp file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as outfile:
+        json.dump(cache, outfile, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def crossref_facts(dois, cache):
+    """Look up DOIs in Crossref in batches and cache what the harvest needs.
+
+    Each DOI Crossref knows about gets its work type, author count and
+    full text PDF link, from one filter query with select= per batch.
+    """
+    email = os.getenv("EMAIL", "library@caltech.edu")
+    missing = [doi for doi in dois if doi.lower() not in cache and "," not in doi]
+    for i in range(0, len(missing), BATCH_SIZE):
+        batch = missing[i : i + BATCH_SIZE]
+        params = {
+            "filter": ",".join(f"doi:{doi}" for doi in batch),
+            "select": "DOI,type,author,link",
+            "rows": len(batch),
+            "mailto": email,
+        }
+        try:
+            response = get_session().get(
+                "https://api.crossref.org/works", params=params
+            )
+            items = response.json()["message"]["items"]
+        except Exception:
+            # Unresolved DOIs stay eligible, so a failed lookup only costs
+            # the savings
+            continue
+        for item in items:
+            pdf = None
+            for link in item.get("link", []):
+                if link.get("content-type") == "application/pdf":
+                    pdf = link["URL"]
+                    break
+            cache[item["DOI"].lower()] = {
+                "type": item["type"],
+                "agency": "Crossref",
+                "authors": len(item.get("author", [])),
+                "pdf": pdf,
+            }
+    return {doi: cache.get(doi.lower()) for doi in dois}
+
+
+def pdf_sizes(dois, cache, workers=8):
+    # Content-Length of each cached PDF link, from a HEAD request the first
+    # time it is needed
+    entries = [cache.get(doi.lower(), {}) for doi in dois]
+    pending = [e for e in entries if e.get("pdf") and "pdf_size" not in e]
+
+    def head(entry):
+        try:
+            response = get_session().head(entry["pdf"], allow_redirects=True)
+            entry["pdf_size"] = int(response.headers.get("Content-Length", 0))
+        except Exception:
+            pass
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(head, pending))
+    return {doi: cache.get(doi.lower(), {}).get("pdf_size") for doi in dois}
+
+
+def registration_agencies(dois):
+    # doi.org answers for many comma separated DOIs at once
+    agencies = {}
+    dois = [doi for doi in dois if "," not in doi]
+    for i in range(0, len(dois), BATCH_SIZE):
+        batch = dois[i : i + BATCH_SIZE]
+        try:
+            response = get_session().get("https://doi.org/ra/" + ",".join(batch))
+            items = response.json()
+        except Exception:
+            continue
+        for item in items:
+            if "RA" in item:
+                agencies[item["DOI"].lower()] = item["RA"]
+    return agencies
+
+
+def resolve(dois, cache):
+    """Look up the work type and registration agency of each DOI.
+
+    Facts are taken from the cache where possible and only DOIs that were
+    found are cached, since unregistered DOIs may turn up later.
+    """
+    crossref_facts(dois, cache)
+    missing = [doi for doi in dois if doi.lower() not in cache]
+    for doi, agency in registration_agencies(missing).items():
+        cache[doi] = {"type": None, "agency": agency}
+    return {doi: cache.get(doi.lower(), {"type": None, "agency": None}) for doi in dois}
+
+
+def ineligible(facts, skip_preprints=False):
+    # Returns why a DOI shouldn't go through the pipeline, or None
+    if facts["harvested"]:
+        return "has already been harvested"
+    if facts["type"] in EXCLUDED_TYPES:
+        return f"is a {facts['type']}"
+    if facts["agency"] is not None and facts["agency"] not in AGENCIES:
+        return f"is registered with {facts['agency']}"
+    if skip_preprints and facts["preprint"]:
+        return "is a preprint"
+    return None
+
+
+def preflight(
+    dois,
+    harvested_dois=(),
+    production=True,
+    token=None,
+    skip_preprints=False,
+    cache_file=CACHE_FILE,
+):
+    """Resolve cheap facts for many DOIs before the per-DOI pipeline.
+
+    Returns a dict of DOI to facts (type, agency, preprint, harvested and
+    the reason it is ineligible, if any). A DOI that can't be resolved is
+    left eligible, so doi2rdm reports it as not found.
+    """
+    existing = check_dois(
+        [doi for doi in dois if doi not in harvested_dois],
+        production=production,
+        token=token,
+    )
+    # Harvested DOIs are skipped anyway, so only look up the rest
+    pending = [doi for doi in dois if doi not in harvested_dois and not existing[doi]]
+    cache = load_cache(cache_file)
+    cached = len(cache)
+    resolved = resolve(pending, cache)
+    if len(cache) != cached:
+        save_cache(cache, cache_file)
+    results = {}
+    for doi in dois:
+        facts = dict(resolved.get(doi, {"type": None, "agency": None}))
+        facts["preprint"] = (
+            facts["type"] == "posted-content" or doi.lower().startswith(ARXIV_PREFIX)
+        )
+        facts["harvested"] = doi in harvested_dois or existing.get(doi, False)
+        facts["reason"] = ineligible(facts, skip_preprints)
+        results[doi] = facts
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report which DOIs in a list are eligible for harvesting"
+    )
+    parser.add_argument("doi_list", help="File with one DOI per line")
+    parser.add_argument("-test", dest="production", action="store_false")
+    parser.add_argument(
+        "-skip-preprints", help="Treat preprints as ineligible", action="store_true"
+    )
+    args = parser.parse_args()
+
+    with open(args.doi_list) as infile:
+        dois = list(dict.fromkeys(infile.read().split()))
+    with open("harvested_dois.txt") as infile:
+        harvested_dois = set(infile.read().splitlines())
+    results = preflight(
+        dois,
+        harvested_dois,
+        production=args.production,
+        token=os.getenv("RDMTOK"),
+        skip_preprints=args.skip_preprints,
+    )
+    for doi, facts in results.items():
+        if facts["reason"]:
+            print(f"error=DOI {doi} {facts['reason']}, skipping")
+        else:
+            print(f"doi={doi}")
@@ -0,0 +1,64 @@
+import os, json
+import datetime
+import threading
+
+# Outcomes that mean the harvest itself failed and needs attention
+FAILED = {"error"}
+
+
+class ResultSink:
+    """Append-only JSONL file with one harvest outcome per DOI.
+
+    A sink without a path discards results, so callers don't need to
+    check whether results were requested.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(
+        self,
+        doi,
+        status,
+        timings=None,
+        error=None,
+        error_class=None,
+        record_id=None,
+    ):
+        if self.path is None:
+            return
+        result = {
+            "doi": doi,
+            "status": status,
+            "error": error,
+            "error_class": error_class,
+            "record_id": record_id,
+            "timings": timings or {},
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        with self.lock:
+            with open(self.path, "a") as outfile:
+                outfile.write(json.dumps(result) + "\n")
+
+
+def result_files(path):
+    # A results path can be a single file or a directory of downloaded
+    # artifacts, one file per harvest job
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            for name in sorted(files):
+                if name.endswith(".jsonl"):
+                    yield os.path.join(root, name)
+    elif os.path.exists(path):
+        yield path
+
+
+def read_results(path):
+    # Stream results one at a time rather than loading every file
+    for filename in result_files(path):
+        with open(filename) as infile:
+            for line in infile:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
@@ -0,0 +1,69 @@
+import os, json
+import time
+
+
+class RetryQueue:
+    """Persistent queue of DOIs to retry with exponential backoff.
+
+    DOIs that are not yet registered or fail part way through the pipeline
+    are deferred, and only come back once their backoff has passed. After
+    max_attempts a DOI moves to the dead letter list for manual review.
+    """
+
+    def __init__(
+        self,
+        path="deferred_dois.json",
+        max_attempts=8,
+        base_delay=3600,
+        max_delay=7 * 24 * 3600,
+    ):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deferred = {}
+        self.dead = {}
+        if os.path.exists(path):
+            with open(path) as infile:
+                data = json.load(infile)
+            self.deferred = data.get("deferred", {})
+            self.dead = data.get("dead", {})
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as outfile:
+            json.dump(
+                {"deferred": self.deferred, "dead": self.dead}, outfile, indent=2
+            )
+        os.replace(tmp, self.path)
+
+    def due(self, now=None):
+        # DOIs whose backoff has passed, with the review message they had
+        if now is None:
+            now = time.time()
+        return {
+            doi: entry.get("review_message")
+            for doi, entry in self.deferred.items()
+            if entry["next_attempt"] <= now
+        }
+
+    def defer(self, doi, error, review_message=None):
+        # Returns False once the DOI has been moved to the dead letter list
+        entry = self.deferred.pop(doi, {"attempts": 0})
+        entry["attempts"] += 1
+        entry["last_error"] = error
+        entry["review_message"] = review_message
+        if entry["attempts"] >= self.max_attempts:
+            self.dead[doi] = entry
+            self.save()
+            return False
+        delay = min(self.base_delay * 2 ** (entry["attempts"] - 1), self.max_delay)
+        entry["next_attempt"] = time.time() + delay
+        self.deferred[doi] = entry
+        self.save()
+        return True
+
+    def done(self, doi):
+        if doi in self.deferred:
+            del self.deferred[doi]
+            self.save()
@@ -0,0 +1,245 @@
+import os, json
+import argparse
+import glob
+import re
+import sqlite3
+import threading
+import unicodedata
+import zipfile
+from functools import lru_cache
+
+INDEX_FILE = "ror_index.db"
+DUMP_DIR = "ror_dumps"
+
+# Bumped when what gets indexed changes, so existing indexes are rebuilt
+SCHEMA = "2"
+
+# Words that don't help tell organizations apart
+STOP_WORDS = {"of", "the", "and", "at", "for", "in", "de", "la", "du", "der", "und"}
+
+_local = threading.local()
+
+
+def normalize_name(name):
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", name.lower()).split())
+
+
+def name_tokens(name):
+    return [t for t in normalize_name(name).split() if t not in STOP_WORDS]
+
+
+def normalize_id(value):
+    # ISNIs come with and without spaces
+    return value.lower().replace(" ", "")
+
+
+def latest_dump(dump_dir=DUMP_DIR):
+    # ROR dumps are named like v1.45-2024-05-02-ror-data.zip
+    dumps = glob.glob(os.path.join(dump_dir, "*.zip"))
+    if not dumps:
+        return None
+    return max(dumps, key=os.path.getmtime)
+
+
+def read_dump(path):
+    with zipfile.ZipFile(path) as dump:
+        names = [n for n in dump.namelist() if n.endswith(".json")]
+        # Newer dumps carry both schemas; prefer v2 when present
+        v2 = [n for n in names if "schema_v2" in n]
+        with dump.open((v2 or names)[0]) as infile:
+            return json.load(infile)
+
+
+def organization_fields(org):
+    # Returns the ROR id, names and external ids from a v1 or v2 record.
+    # Acronyms are left out, since they collide with countries and other
+    # common words in affiliation strings (USA, CIT, ...)
+    ror = org["id"].split("ror.org/")[-1]
+    external = []
+    if "names" in org:
+        names = [
+            n["value"] for n in org["names"] if "acronym" not in n.get("types", [])
+        ]
+        for idv in org.get("external_ids", []):
+            for value in idv.get("all", []):
+                external.append((idv["type"].lower(), value))
+    else:
+        names = [org["name"]] + org.get("aliases", [])
+        names += [label["label"] for label in org.get("labels", [])]
+        for scheme, idv in org.get("external_ids", {}).items():
+            values = idv.get("all", [])
+            if isinstance(values, str):
+                values = [values]
+            for value in values:
+                external.append((scheme.lower(), value))
+    return ror, names, external
+
+
+def ingest(dump, index=INDEX_FILE):
+    """Build the local ROR index from a ROR data dump zip.
+
+    Returns False without rebuilding when the index is already built from
+    this dump.
+    """
+    version = f"{SCHEMA}:{os.path.basename(dump)}"
+    if os.path.exists(index):
+        with sqlite3.connect(index) as db:
+            row = db.execute(
+                "select value from meta where key = 'version'"
+            ).fetchone()
+        if row and row[0] == version:
+            return False
+    tmp = index + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    db = sqlite3.connect(tmp)
+    db.executescript(
+        """
+        create table meta (key text primary key, value text);
+        create table external_ids (scheme text, value text, ror text,
+            primary key (scheme, value));
+        create table names (id integer primary key, name text, ror text,
+            ntokens integer);
+        create table tokens (token text, name_id integer);
+        """
+    )
+    for org in read_dump(dump):
+        ror, names, external = organization_fields(org)
+        db.executemany(
+            "insert or ignore into external_ids values (?, ?, ?)",
+            [(scheme, normalize_id(value), ror) for scheme, value in external],
+        )
+        for name in set(names):
+            tokens = set(name_tokens(name))
+            if not tokens:
+                continue
+            cursor = db.execute(
+                "insert into names (name, ror, ntokens) values (?, ?, ?)",
+                (normalize_name(name), ror, len(tokens)),
+            )
+            db.executemany(
+                "insert into tokens values (?, ?)",
+                [(token, cursor.lastrowid) for token in tokens],
+            )
+    db.executescript(
+        """
+        create index names_name on names (name);
+        create index tokens_token on tokens (token);
+        """
+    )
+    db.execute("insert into meta values ('version', ?)", (version,))
+    db.commit()
+    db.close()
+    # Swap the new index in so running harvests never see a partial index
+    os.replace(tmp, index)
+    lookup_external_id.cache_clear()
+    match_affiliation.cache_clear()
+    return True
+
+
+@lru_cache(maxsize=None)
+def ensure_index(index=INDEX_FILE, dump_dir=DUMP_DIR):
+    # Once per process, rebuild the index if a new dump has been dropped in,
+    # and report whether an offline index is available
+    dump = latest_dump(dump_dir)
+    if dump is not None:
+        ingest(dump, index)
+    return os.path.exists(index)
+
+
+def connect(index=INDEX_FILE):
+    # One read only connection per thread, reopened if the index was replaced
+    mtime = os.path.getmtime(index)
+    db = getattr(_local, "db", None)
+    if db is None or _local.mtime != mtime:
+        db = sqlite3.connect(f"file:{index}?mode=ro", uri=True)
+        _local.db = db
+        _local.mtime = mtime
+    return db
+
+
+@lru_cache(maxsize=100000)
+def lookup_external_id(scheme, value):
+    # e.g. ("grid", "grid.20861.3d") -> "05dxps055"
+    row = (
+        connect()
+        .execute(
+            "select ror from external_ids where scheme = ? and value = ?",
+            (scheme.lower(), normalize_id(value)),
+        )
+        .fetchone()
+    )
+    return row[0] if row else None
+
+
+@lru_cache(maxsize=100000)
+def match_affiliation(raw):
+    """Match a raw affiliation string to a ROR id.
+
+    Each comma separated part is first matched exactly against organization
+    names and aliases. One word names only match the whole string, so a
+    trailing country or city can't match an organization. Otherwise the
+    longest name whose tokens all appear in the string wins, as long as
+    only one organization has that name.
+    """
+    db = connect()
+    parts = raw.split(",")
+    for part in parts:
+        name = normalize_name(part)
+        rows = db.execute(
+            "select ror from names where name = ? and (ntokens > 1 or ?)",
+            (name, len(parts) == 1),
+        )
+        rors = {ror for (ror,) in rows}
+        if len(rors) == 1:
+            return rors.pop()
+    tokens = set(name_tokens(raw))
+    if not tokens:
+        return None
+    placeholders = ",".join("?" * len(tokens))
+    rows = db.execute(
+        f"""select names.ror, names.ntokens from tokens
+        join names on names.id = tokens.name_id
+        where tokens.token in ({placeholders})
+        group by tokens.name_id
+        having count(*) = names.ntokens and names.ntokens > 1
+        order by names.ntokens desc""",
+        list(tokens),
+    ).fetchall()
+    if not rows:
+        return None
+    best = rows[0][1]
+    rors = {ror for ror, ntokens in rows if ntokens == best}
+    if len(rors) == 1:
+        return rors.pop()
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build and query an offline index of the ROR data dump"
+    )
+    parser.add_argument("command", help="ingest, grid, isni, match")
+    parser.add_argument(
+        "value",
+        nargs="?",
+        help="Dump zip to ingest (default newest in ror_dumps), or id or affiliation",
+    )
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        dump = args.value or latest_dump()
+        if dump is None:
+            print(f"error= no ROR dump found in {DUMP_DIR}")
+        elif ingest(dump):
+            print(f"Built {INDEX_FILE} from {dump}")
+        else:
+            print(f"{INDEX_FILE} is already up to date with {dump}")
+    elif args.command in ["grid", "isni"]:
+        print(lookup_external_id(args.command, args.value))
+    elif args.command == "match":
+        print(match_affiliation(args.value))
+    else:
+        print(f"error= invalid command: {args.command}")
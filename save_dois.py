@@ -1,10 +1,36 @@
-import sys, json
+import argparse
+from coordination import merge_harvested
+from results import read_results
+from retry_queue import RetryQueue
 
-result = json.loads(sys.argv[1])
+# Outcomes that are worth another try in a later run
+RETRY = {"error", "not_found"}
 
-dois = result["doi"]
+parser = argparse.ArgumentParser(
+    description="Add harvested DOIs from harvest results to harvested_dois.txt"
+)
+# Results can be a single JSONL file or a directory of downloaded artifacts
+parser.add_argument("results", help="Results file or directory")
+parser.add_argument(
+    "-retry-queue",
+    help="Defer failed and not found DOIs to this queue, and clear the rest",
+)
+args = parser.parse_args()
 
-for doi in dois.keys():
-    if dois[doi] != None:
-        with open("harvested_dois.txt", "a") as f:
-            f.write(doi + "\n")
+results = list(read_results(args.results))
+dois = [result["doi"] for result in results if result["status"] == "harvested"]
+
+merge_harvested(dois)
+
+if args.retry_queue:
+    retry_queue = RetryQueue(args.retry_queue)
+    for result in results:
+        if result["status"] in RETRY:
+            if retry_queue.defer(result["doi"], result["error"]):
+                print(f"deferred={result['doi']}")
+            else:
+                print(f"dead_letter={result['doi']}")
+        else:
+            retry_queue.done(result["doi"])
+    # Saved even when nothing changed, so the workflow always has a file
+    retry_queue.save()
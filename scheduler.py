@@ -0,0 +1,317 @@
+import os, json
+import argparse
+import collections
+import datetime
+import itertools
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from idutils import normalize_doi
+from check_doi import check_doi
+from harvest import (
+    get_crossref_ror,
+    get_dimensions,
+    get_orcid_works,
+    transform_doi,
+    write_record,
+    load_people_data,
+    get_dsl,
+)
+from wos import get_wos_dois
+from traceback import format_exc
+from utils import format_error
+from sessions import get_session
+from licenses import write_unmatched_report
+from coordination import merge_harvested
+from transform_cache import TransformCache
+
+# Lower numbers are worked first, so manual requests jump ahead of bulk harvests
+PRIORITIES = {"doi": 0, "orcid": 0, "crossref": 5, "dimensions": 5, "wos": 10}
+
+MESSAGES = {
+    "crossref": "Automatically added from @crossref based on Caltech ROR affiliation.",
+    "dimensions": "Automatically added from @dimensions Caltech affiliation harvest with metadata from Crossref.",
+    "wos": "Automatically added from Web of Science Caltech affiliation harvest.",
+    "orcid": "Automatically added from @ORCID from record {value}.",
+    "doi": "Automatically added as part of import from DOI list: {value}.",
+}
+
+
+def load_jobs(path):
+    # Jobs that were queued or running when the service last stopped
+    if os.path.exists(path):
+        with open(path) as infile:
+            return json.load(infile)
+    return []
+
+
+def load_watermarks(path):
+    if os.path.exists(path):
+        with open(path) as infile:
+            return json.load(infile)
+    watermarks = {}
+    # Start the Crossref harvest where the workflow harvest left off
+    if os.path.exists("last_run.txt"):
+        with open("last_run.txt") as infile:
+            watermarks["crossref"] = infile.read().strip("\n")
+    return watermarks
+
+
+class Scheduler:
+    def __init__(
+        self,
+        token,
+        production=True,
+        publish=False,
+        watermark_file="watermarks.json",
+        queue_file="scheduler_queue.json",
+    ):
+        self.token = token
+        self.production = production
+        self.publish = publish
+        if production:
+            self.community = "aedd135f-227e-4fdf-9476-5b3fd011bac6"
+        else:
+            self.community = "fb980d43-af44-48bc-bdd6-f785653038b8"
+        self.watermark_file = watermark_file
+        self.watermarks = load_watermarks(watermark_file)
+        with open("harvested_dois.txt") as infile:
+            self.harvested_dois = set(infile.read().splitlines())
+        self.transform_cache = TransformCache()
+        self.queue = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.pending = collections.Counter()
+        self.lock = threading.Lock()
+        # Every queued job is also kept on disk until it finishes, so a
+        # restart picks up where the service stopped
+        self.queue_file = queue_file
+        self.jobs = {}
+        for priority, job in load_jobs(queue_file):
+            self.enqueue(
+                job["type"], job["value"], job["message"], priority, save=False
+            )
+
+    def enqueue(self, job_type, value=None, message=None, priority=None, save=True):
+        if job_type not in PRIORITIES:
+            raise ValueError(f"invalid job type: {job_type}")
+        if priority is None:
+            priority = PRIORITIES[job_type]
+        job = {"type": job_type, "value": value, "message": message}
+        # The counter keeps jobs with equal priority in first in, first out order
+        count = next(self.counter)
+        with self.lock:
+            self.pending[job_type] += 1
+            self.jobs[count] = (priority, job)
+            if save:
+                self.save_jobs()
+        self.queue.put((priority, count, job))
+
+    def save_jobs(self):
+        # Called with the lock held
+        tmp = self.queue_file + ".tmp"
+        with open(tmp, "w") as outfile:
+            json.dump([self.jobs[count] for count in sorted(self.jobs)], outfile)
+        os.replace(tmp, self.queue_file)
+
+    def status(self):
+        with self.lock:
+            pending = {k: v for k, v in self.pending.items() if v > 0}
+            watermarks = dict(self.watermarks)
+        return {
+            "depth": self.queue.qsize(),
+            "pending": pending,
+            "watermarks": watermarks,
+        }
+
+    def save_watermark(self, source, value):
+        with self.lock:
+            self.watermarks[source] = value
+            with open(self.watermark_file, "w") as outfile:
+                json.dump(self.watermarks, outfile, indent=2)
+
+    def fetch_source(self, source, value):
+        today = datetime.date.today()
+        if source == "crossref":
+            last_run = self.watermarks.get("crossref", today.isoformat())
+            dois = get_crossref_ror(last_run=last_run)
+        elif source == "dimensions":
+            # Dimensions records show up late, so always look back a week
+            # from the last run
+            last_run = self.watermarks.get("dimensions", today.isoformat())
+            last_run = datetime.date.fromisoformat(last_run)
+            dois = get_dimensions(
+                since=(last_run - datetime.timedelta(days=7)).isoformat()
+            )
+        elif source == "wos":
+            last_run = self.watermarks.get("wos", today.isoformat())
+            days = (today - datetime.date.fromisoformat(last_run)).days
+            dois = get_wos_dois(f"{max(days, 1)}D")
+        else:
+            return get_orcid_works(value)
+        return dois
+
+    def harvest_doi(self, doi, review_message):
+        doi = normalize_doi(doi)
+        if doi in self.harvested_dois:
+            print(f"error=DOI {doi} is already in CaltechAUTHORS, skipping")
+            return
+        if check_doi(doi, production=self.production, token=self.token):
+            print(f"error=DOI {doi} has already been harvested, skipping")
+            return
+        result = transform_doi(
+            doi,
+            review_message,
+            self.token,
+            self.production,
+            cache=self.transform_cache,
+        )
+        if result is None:
+            return
+        data, review_message, files = result
+        write_record(
+            data,
+            self.token,
+            self.production,
+            self.community,
+            review_message,
+            files,
+            publish=self.publish,
+        )
+        print("doi=", doi)
+        with self.lock:
+            self.harvested_dois.add(doi)
+        merge_harvested([doi])
+
+    def run_job(self, priority, job):
+        job_type = job["type"]
+        message = job["message"]
+        if message is None:
+            message = MESSAGES[job_type].format(value=job["value"])
+        if job_type == "doi":
+            self.harvest_doi(job["value"], message)
+            with self.lock:
+                write_unmatched_report()
+        else:
+            # Source jobs expand into DOI jobs at the priority of the source.
+            # The watermark only moves once those jobs are saved, so DOIs
+            # behind it can't be lost in a restart
+            today = datetime.date.today().isoformat()
+            for doi in self.fetch_source(job_type, job["value"]):
+                self.enqueue("doi", doi, message=message, priority=priority, save=False)
+            with self.lock:
+                self.save_jobs()
+            if job_type != "orcid":
+                self.save_watermark(job_type, today)
+
+    def worker(self):
+        while True:
+            priority, count, job = self.queue.get()
+            try:
+                self.run_job(priority, job)
+            except Exception as e:
+                cleaned = format_error(format_exc())
+                print(f"error= system error with {job['type']} job {cleaned}")
+            finally:
+                with self.lock:
+                    self.pending[job["type"]] -= 1
+                    del self.jobs[count]
+                    self.save_jobs()
+                self.queue.task_done()
+
+    def schedule(self, interval):
+        # Queue the regular source harvests every interval hours
+        while True:
+            self.enqueue("crossref")
+            self.enqueue("dimensions")
+            time.sleep(interval * 3600)
+
+
+def make_handler(scheduler):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/queue":
+                self.send_json(200, scheduler.status())
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/enqueue":
+                self.send_json(404, {"error": "not found"})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                job = json.loads(self.rfile.read(length))
+                if not isinstance(job, dict):
+                    raise ValueError("job must be a JSON object")
+                scheduler.enqueue(job["type"], job.get("value"), job.get("message"))
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            self.send_json(202, scheduler.status())
+
+    return Handler
+
+
+def serve(args):
+    token = os.getenv("RDMTOK")
+    scheduler = Scheduler(token, production=not args.test, publish=args.publish)
+    # Warm up reference data and the Dimensions login before taking work
+    load_people_data()
+    get_dsl()
+    for i in range(args.workers):
+        threading.Thread(target=scheduler.worker, daemon=True).start()
+    if args.interval > 0:
+        threading.Thread(
+            target=scheduler.schedule, args=(args.interval,), daemon=True
+        ).start()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(scheduler))
+    print(f"Scheduler listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Long running harvest scheduler with a prioritized work queue"
+    )
+    parser.add_argument("command", help="serve, enqueue, status")
+    parser.add_argument(
+        "job_type", nargs="?", help="doi, orcid, crossref, dimensions, wos"
+    )
+    parser.add_argument("value", nargs="?", help="DOI or ORCID for the job")
+    parser.add_argument("-message", help="Message to use in submission comment")
+    parser.add_argument("-port", type=int, default=8765, help="Local port")
+    parser.add_argument("-workers", type=int, default=1, help="Worker threads")
+    parser.add_argument(
+        "-interval",
+        type=float,
+        default=24,
+        help="Hours between scheduled source harvests (0 to disable)",
+    )
+    parser.add_argument("-test", help="Test mode", action="store_true")
+    parser.add_argument(
+        "-publish",
+        help="Immediately publish records (does not go to review queue)",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    url = f"http://127.0.0.1:{args.port}"
+    if args.command == "serve":
+        serve(args)
+    elif args.command == "enqueue":
+        job = {"type": args.job_type, "value": args.value, "message": args.message}
+        response = get_session().post(f"{url}/enqueue", json=job)
+        print(response.json())
+    elif args.command == "status":
+        print(json.dumps(get_session().get(f"{url}/queue").json(), indent=2))
+    else:
+        print(f"error= invalid command: {args.command}")
@@ -0,0 +1,47 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from limiter import get_limiter, THROTTLED
+from tracing import span
+
+_local = threading.local()
+
+# Throttled requests are retried after the host's backoff
+MAX_RETRIES = 4
+
+
+class LimitedSession(requests.Session):
+    # Routes every request through the adaptive limiter for its host
+    def request(self, method, url, *args, **kwargs):
+        host = urlsplit(url).hostname
+        limiter = get_limiter().host(host)
+        with span(f"HTTP {method}", **{"http.url": url, "net.peer.name": host}) as s:
+            for attempt in range(MAX_RETRIES + 1):
+                limiter.acquire()
+                start = time.perf_counter()
+                try:
+                    response = super().request(method, url, *args, **kwargs)
+                except Exception:
+                    limiter.release(None)
+                    raise
+                limiter.release(
+                    time.perf_counter() - start,
+                    response.status_code,
+                    response.headers.get("Retry-After"),
+                )
+                s.set_attribute("http.status_code", response.status_code)
+                s.set_attribute("http.retries", attempt)
+                if response.status_code not in THROTTLED or attempt == MAX_RETRIES:
+                    return response
+                response.close()
+
+
+def get_session():
+    # Reuse one HTTP session (and its connection pool) per thread
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = LimitedSession()
+        _local.session = session
+    return session
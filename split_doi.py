@@ -1,6 +1,65 @@
 import json, os
+import argparse
+import heapq
 
-data = os.environ["DOI"]
+from preflight import load_cache, save_cache, crossref_facts, pdf_sizes
+from retry_queue import RetryQueue
 
-data = data.split()
-print("matrix=", json.dumps(data))
+# Rough relative cost of harvesting a DOI. Every DOI pays for doi2rdm,
+# record checks and Dimensions; authors each need ROR and ORCID matching
+# and open access PDFs have to be downloaded and uploaded
+BASE_COST = 1.0
+AUTHOR_COST = 0.01
+PDF_COST = 2.0
+PDF_MB_COST = 0.5
+
+
+def estimate_cost(facts):
+    cost = BASE_COST
+    if facts is None:
+        return cost
+    cost += AUTHOR_COST * facts.get("authors", 0)
+    if facts.get("pdf"):
+        # The size comes from a cached HEAD request on the PDF link
+        cost += PDF_COST + PDF_MB_COST * facts.get("pdf_size", 0) / 1e6
+    return cost
+
+
+def balance(costs, shards):
+    """Assign DOIs to shards with the longest processing time first rule.
+
+    The most expensive remaining DOI always goes to the least loaded shard.
+    """
+    heap = [(0.0, i, []) for i in range(min(shards, len(costs)))]
+    for doi, cost in sorted(costs.items(), key=lambda c: c[1], reverse=True):
+        load, i, dois = heapq.heappop(heap)
+        dois.append(doi)
+        heapq.heappush(heap, (load + cost, i, dois))
+    return [dois for load, i, dois in sorted(heap, reverse=True)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Split the DOIs in $DOI into cost balanced shards for a job matrix"
+    )
+    parser.add_argument(
+        "-shards", help="Maximum number of shards", type=int, default=20
+    )
+    parser.add_argument(
+        "-retry-queue", help="Also split the due DOIs from this deferred DOI queue"
+    )
+    args = parser.parse_args()
+
+    data = os.environ["DOI"]
+
+    data = data.split()
+    if args.retry_queue:
+        data += list(RetryQueue(args.retry_queue).due())
+    data = list(dict.fromkeys(data))
+    cache = load_cache()
+    facts = crossref_facts(data, cache)
+    pdf_sizes(data, cache)
+    save_cache(cache)
+    costs = {doi: estimate_cost(facts[doi]) for doi in data}
+    shards = [" ".join(dois) for dois in balance(costs, args.shards)]
+    print("matrix=", json.dumps(shards))
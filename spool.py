@@ -0,0 +1,24 @@
+import gzip
+import json
+
+
+def append_spool(spool, doi, record, review_message, files=None):
+    # Append one fully enriched record to a gzip compressed JSONL spool.
+    # Each append is a separate gzip member, which gzip.open reads transparently
+    entry = {
+        "doi": doi,
+        "record": record,
+        "review_message": review_message,
+        "files": files,
+    }
+    with gzip.open(spool, "at", encoding="utf-8") as outfile:
+        outfile.write(json.dumps(entry) + "\n")
+
+
+def read_spool(spool):
+    # Stream staged entries back out of a spool one at a time
+    with gzip.open(spool, "rt", encoding="utf-8") as infile:
+        for line in infile:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
@@ -1,9 +1,223 @@
 import os, argparse
+import csv
+import time
 
 from caltechdata_api import caltechdata_write
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from traceback import format_exc
 from utils import format_error
+from sessions import get_session
+from check_doi import check_written
+from limiter import get_limiter
+
+COMMUNITIES = {
+    "california_tech": {
+        True: "2de36d2e-df7d-4daa-85c2-31334ffec356",
+        False: "8f398a9c-4c33-48ae-a60e-c5c96438121c",
+    }
+}
+
+# Title shared by every record a template makes, used to prefetch what exists
+TITLES = {"california_tech": "California Tech"}
+
+
+def california_tech(volume, issue, date):
+    try:
+        formatted_date = datetime.strptime(date, "%Y-%m-%d").strftime("%B %-d, %Y")
+    except ValueError:
+        raise ValueError(f"Invalid date format (expected YYYY-MM-DD): {date}")
+
+    return {
+        "custom_fields": {
+            "caltech:publication_status": [{"id": "published"}],
+            "imprint:imprint": {"place": "Pasadena, CA"},
+            "journal:journal": {
+                "issue": issue,
+                "title": "California Tech",
+                "volume": volume,
+            },
+        },
+        "metadata": {
+            "additional_titles": [
+                {
+                    "lang": {"id": "eng"},
+                    "title": "Tech",
+                    "type": {"id": "alternative-title"},
+                }
+            ],
+            "contributors": [
+                {
+                    "person_or_org": {
+                        "family_name": "Wilson",
+                        "given_name": "Damien",
+                        "identifiers": [
+                            {"identifier": "Wilson-Damien", "scheme": "clpid"}
+                        ],
+                        "name": "Wilson, Damien",
+                        "type": "personal",
+                    },
+                    "role": {"id": "editor"},
+                }
+            ],
+            "creators": [
+                {
+                    "affiliations": [{"id": "05dxps055"}],
+                    "person_or_org": {
+                        "identifiers": [
+                            {
+                                "identifier": "Associated-Students-of-the-California-Institute-of-Technology",
+                                "scheme": "clpid",
+                            }
+                        ],
+                        "name": "Associated Students of the California Institute of Technology, Inc.",
+                        "type": "organizational",
+                    },
+                    "role": {"id": "issuing-body"},
+                }
+            ],
+            "languages": [{"id": "eng"}],
+            "publication_date": date,
+            "publisher": "California Institute of Technology",
+            "related_identifiers": [
+                {
+                    "identifier": "https://tech.caltech.edu/",
+                    "relation_type": {"id": "ispublishedin"},
+                    "resource_type": {"id": "publication-newspaper"},
+                    "scheme": "url",
+                }
+            ],
+            "resource_type": {"id": "publication-newspaperissue"},
+            "rights": [{"id": "default"}],
+            "subjects": [{"subject": "Caltech student newspaper"}],
+            "title": f"California Tech, v. {volume}, no. {issue}, {formatted_date}",
+            "version": "Published",
+        },
+    }
+
+
+TEMPLATES = {"california_tech": california_tech}
+
+
+def normalize_title(title):
+    return " ".join(title.lower().split())
+
+
+def read_schedule(path):
+    # Rows of volume, issue and date from a CSV file with a header or a YAML
+    # list of mappings
+    if path.endswith((".yaml", ".yml")):
+        import yaml
+
+        with open(path) as infile:
+            rows = yaml.safe_load(infile) or []
+    else:
+        with open(path, newline="") as infile:
+            rows = list(csv.DictReader(infile))
+    # YAML turns dates and numbers into other types
+    return [
+        {"volume": str(r["volume"]), "issue": str(r["issue"]), "date": str(r["date"])}
+        for r in rows
+    ]
+
+
+def existing_titles(title, token, production=True):
+    # One pass over the published records and our own drafts with this
+    # title, instead of a search per issue
+    if production == False:
+        base_url = "https://authors.caltechlibrary.dev/"
+    else:
+        base_url = "https://authors.library.caltech.edu/"
+    headers = {}
+    if token:
+        headers = {"Authorization": f"Bearer {token}"}
+    titles = set()
+    query = f'?q=metadata.title:"{title}"&size=100'
+    urls = [f"{base_url}api/records{query}&allversions=true"]
+    if token:
+        urls.append(f"{base_url}api/user/records{query}")
+    for url in urls:
+        while url:
+            response = get_session().get(url, headers=headers)
+            if response.status_code != 200:
+                raise Exception(response.text)
+            data = response.json()
+            for record in data["hits"]["hits"]:
+                titles.add(normalize_title(record["metadata"]["title"]))
+            url = data["links"].get("next")
+    return titles
+
+
+def create_records(
+    harvest_type, rows, token, production, actor, workers=4, retries=3
+):
+    # Create a template record for each scheduled row that doesn't exist yet
+    template = TEMPLATES[harvest_type]
+    community = COMMUNITIES[harvest_type][production]
+    review_message = f"Template record created for California Tech by {actor} "
+    if production == False:
+        host = "authors.caltechlibrary.dev"
+    else:
+        host = "authors.library.caltech.edu"
+    limiter = get_limiter().host(host)
+
+    existing = existing_titles(TITLES[harvest_type], token, production)
+    records = []
+    for row in rows:
+        try:
+            metadata = template(row["volume"], row["issue"], row["date"])
+        except ValueError as e:
+            print(f"error= {e}")
+            continue
+        title = normalize_title(metadata["metadata"]["title"])
+        if title in existing:
+            print(f"skipped= {metadata['metadata']['title']} already exists")
+            continue
+        existing.add(title)
+        records.append(metadata)
+
+    def written(title):
+        try:
+            return check_written(title, production=production, token=token)
+        except Exception:
+            # Without an answer a retry could make a duplicate
+            return True
+
+    def create(metadata):
+        title = metadata["metadata"]["title"]
+        for attempt in range(retries + 1):
+            if attempt > 0 and written(title):
+                print(
+                    f"error= {title} may have been partly written before an error, check drafts and the review queue"
+                )
+                return None
+            try:
+                # Only caps concurrent writes. A 429 from caltechdata_api
+                # surfaces as an exception, backed off by the retry loop
+                with limiter.track():
+                    return caltechdata_write(
+                        metadata,
+                        token,
+                        production=production,
+                        authors=True,
+                        community=community,
+                        publish=False,
+                        review_message=review_message,
+                    )
+            except Exception:
+                if attempt == retries:
+                    cleaned = format_error(format_exc())
+                    print(
+                        f"error= system error with writing metadata to CaltechAUTHORS {cleaned}"
+                    )
+                    return None
+                time.sleep(2**attempt)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for metadata, response in zip(records, executor.map(create, records)):
+            if response is not None:
+                print(f"created= {metadata['metadata']['title']} {response}")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -13,15 +227,17 @@ if __name__ == "__main__":
     parser.add_argument("-issue", help="Issue number")
     parser.add_argument("-volume", help="Volume number")
     parser.add_argument("-date", help="Publication date (YYYY-MM-DD)")
+    parser.add_argument(
+        "-schedule",
+        help="CSV or YAML file of volume, issue and date rows to create in bulk",
+    )
+    parser.add_argument(
+        "-workers", help="Concurrent writers in bulk mode", type=int, default=4
+    )
     parser.add_argument("-actor", help="Name of actor to use for review message")
     parser.add_argument("-test", action="store_true", help="Use the test environment")
     args = parser.parse_args()
 
-    try:
-        formatted_date = datetime.strptime(args.date, "%Y-%m-%d").strftime("%B %-d, %Y")
-    except ValueError:
-        raise ValueError(f"Invalid date format (expected YYYY-MM-DD): {args.date}")
-
     token = os.getenv("RDMTOK")
     harvest_type = args.harvest_type
 
@@ -30,86 +246,26 @@ if __name__ == "__main__":
     else:
         production = True
 
-    if harvest_type == "california_tech":
-
-        if production:
-            community = "2de36d2e-df7d-4daa-85c2-31334ffec356"
-        else:
-            community = "8f398a9c-4c33-48ae-a60e-c5c96438121c"
-
-        metadata = {
-            "custom_fields": {
-                "caltech:publication_status": [{"id": "published"}],
-                "imprint:imprint": {"place": "Pasadena, CA"},
-                "journal:journal": {
-                    "issue": args.issue,
-                    "title": "California Tech",
-                    "volume": args.volume,
-                },
-            },
-            "metadata": {
-                "additional_titles": [
-                    {
-                        "lang": {"id": "eng"},
-                        "title": "Tech",
-                        "type": {"id": "alternative-title"},
-                    }
-                ],
-                "contributors": [
-                    {
-                        "person_or_org": {
-                            "family_name": "Wilson",
-                            "given_name": "Damien",
-                            "identifiers": [
-                                {"identifier": "Wilson-Damien", "scheme": "clpid"}
-                            ],
-                            "name": "Wilson, Damien",
-                            "type": "personal",
-                        },
-                        "role": {"id": "editor"},
-                    }
-                ],
-                "creators": [
-                    {
-                        "affiliations": [{"id": "05dxps055"}],
-                        "person_or_org": {
-                            "identifiers": [
-                                {
-                                    "identifier": "Associated-Students-of-the-California-Institute-of-Technology",
-                                    "scheme": "clpid",
-                                }
-                            ],
-                            "name": "Associated Students of the California Institute of Technology, Inc.",
-                            "type": "organizational",
-                        },
-                        "role": {"id": "issuing-body"},
-                    }
-                ],
-                "languages": [{"id": "eng"}],
-                "publication_date": args.date,
-                "publisher": "California Institute of Technology",
-                "related_identifiers": [
-                    {
-                        "identifier": "https://tech.caltech.edu/",
-                        "relation_type": {"id": "ispublishedin"},
-                        "resource_type": {"id": "publication-newspaper"},
-                        "scheme": "url",
-                    }
-                ],
-                "resource_type": {"id": "publication-newspaperissue"},
-                "rights": [{"id": "default"}],
-                "subjects": [{"subject": "Caltech student newspaper"}],
-                "title": f"California Tech, v. {args.volume}, no. {args.issue}, {formatted_date}",
-                "version": "Published",
-            },
-        }
+    if harvest_type not in TEMPLATES:
+        print(f"error= invalid harvest type: {harvest_type}")
+    elif args.schedule:
+        create_records(
+            harvest_type,
+            read_schedule(args.schedule),
+            token,
+            production,
+            args.actor,
+            workers=args.workers,
+        )
+    else:
+        metadata = TEMPLATES[harvest_type](args.volume, args.issue, args.date)
         try:
             response = caltechdata_write(
                 metadata,
                 token,
                 production=production,
                 authors=True,
-                community=community,
+                community=COMMUNITIES[harvest_type][production],
                 publish=False,
                 review_message=f"Template record created for California Tech by {args.actor} ",
             )
@@ -119,5 +275,3 @@ if __name__ == "__main__":
             print(
                 f"error= system error with writing metadata to CaltechAUTHORS {cleaned}"
             )
-    else:
-        print(f"error= invalid harvest type: {harvest_type}")
@@ -0,0 +1,134 @@
+import os, json
+import contextvars
+import datetime
+import secrets
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# HARVEST_TRACE selects the exporter: file (default), console or off
+TRACE_EXPORTER = os.getenv("HARVEST_TRACE", "file")
+TRACE_FILE = os.getenv("HARVEST_TRACE_FILE", "traces.jsonl")
+
+_current = contextvars.ContextVar("current_span", default=None)
+_lock = threading.Lock()
+
+
+def _timestamp(ns):
+    return (
+        datetime.datetime.fromtimestamp(ns / 1e9, datetime.timezone.utc)
+        .isoformat()
+        .replace("+00:00", "Z")
+    )
+
+
+class Span:
+    """A single timed operation, exported in the OpenTelemetry JSON shape."""
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        if parent is None:
+            self.trace_id = secrets.token_hex(16)
+        else:
+            self.trace_id = parent.trace_id
+        self.span_id = secrets.token_hex(8)
+        self.attributes = dict(attributes or {})
+        self.status = "UNSET"
+        self.description = None
+        self.start = time.time_ns()
+        self.end = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, error):
+        self.status = "ERROR"
+        self.description = f"{type(error).__name__}: {error}"
+
+    def to_json(self):
+        return {
+            "name": self.name,
+            "context": {
+                "trace_id": f"0x{self.trace_id}",
+                "span_id": f"0x{self.span_id}",
+            },
+            "parent_id": f"0x{self.parent.span_id}" if self.parent else None,
+            "start_time": _timestamp(self.start),
+            "end_time": _timestamp(self.end),
+            "duration_ms": (self.end - self.start) / 1e6,
+            "attributes": self.attributes,
+            "status": {"status_code": self.status, "description": self.description},
+        }
+
+
+def export(span):
+    if TRACE_EXPORTER == "off":
+        return
+    line = json.dumps(span.to_json(), default=str)
+    with _lock:
+        if TRACE_EXPORTER == "console":
+            print(line, file=sys.stderr)
+        else:
+            with open(TRACE_FILE, "a") as outfile:
+                outfile.write(line + "\n")
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a block as a span, nested under the current span if there is one.
+
+    A span opened with no current span starts a new trace, so each DOI's
+    harvest gets its own trace id.
+    """
+    current = Span(name, parent=_current.get(), attributes=attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end = time.time_ns()
+        if current.status == "UNSET":
+            current.status = "OK"
+        export(current)
+
+
+def current_span():
+    return _current.get()
+
+
+if __name__ == "__main__":
+    import argparse
+    from collections import defaultdict
+
+    parser = argparse.ArgumentParser(
+        description="Show the slowest traces and their slowest spans"
+    )
+    parser.add_argument("traces", nargs="?", default=TRACE_FILE)
+    parser.add_argument("-top", type=int, default=10, help="Traces to show")
+    args = parser.parse_args()
+
+    roots = []
+    children = defaultdict(list)
+    with open(args.traces) as infile:
+        for line in infile:
+            data = json.loads(line)
+            if data["parent_id"] is None:
+                roots.append(data)
+            else:
+                children[data["context"]["trace_id"]].append(data)
+    roots.sort(key=lambda s: s["duration_ms"], reverse=True)
+    for root in roots[: args.top]:
+        attributes = " ".join(f"{k}={v}" for k, v in root["attributes"].items())
+        print(f"{root['duration_ms'] / 1000:8.1f}s {root['name']} {attributes}")
+        spans = children[root["context"]["trace_id"]]
+        spans.sort(key=lambda s: s["duration_ms"], reverse=True)
+        for child in spans[:5]:
+            attributes = " ".join(
+                f"{k}={v}" for k, v in child["attributes"].items() if k != "doi"
+            )
+            print(f"{child['duration_ms'] / 1000:10.1f}s {child['name']} {attributes}")
@@ -0,0 +1,113 @@
+import os, json
+import argparse
+import gzip
+import hashlib
+import shutil
+import subprocess
+import threading
+from functools import lru_cache
+
+CACHE_DIR = ".transform_cache"
+OPTIONS_FILE = "options.yaml"
+
+
+@lru_cache(maxsize=None)
+def transformer_version():
+    try:
+        result = subprocess.run(
+            ["doi2rdm", "-version"], capture_output=True, text=True, timeout=60
+        )
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+    return result.stdout.strip() or "unknown"
+
+
+@lru_cache(maxsize=8)
+def _options_hash(path, mtime):
+    with open(path, "rb") as infile:
+        return hashlib.sha256(infile.read()).hexdigest()
+
+
+def config_key(options=OPTIONS_FILE):
+    # Changes whenever options.yaml is edited or doi2rdm is upgraded, so
+    # every cached record is invalidated at once
+    digest = hashlib.sha256()
+    digest.update(_options_hash(options, os.path.getmtime(options)).encode())
+    digest.update(transformer_version().encode())
+    return digest.hexdigest()[:16]
+
+
+class TransformCache:
+    """doi2rdm output stored as gzip compressed RDM JSON.
+
+    Entries live in a directory named for the options.yaml and doi2rdm
+    version they were made with, one file per normalized DOI.
+    """
+
+    def __init__(self, path=CACHE_DIR, options=OPTIONS_FILE):
+        self.path = path
+        self.options = options
+
+    def entry(self, doi):
+        name = hashlib.sha256(doi.lower().encode("utf-8")).hexdigest()
+        return os.path.join(self.path, config_key(self.options), f"{name}.json.gz")
+
+    def load(self, doi):
+        # Returns the cached record, or None when it isn't cached
+        path = self.entry(doi)
+        if not os.path.exists(path):
+            return None
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as infile:
+                return json.load(infile)
+        except (OSError, EOFError, ValueError):
+            # A damaged entry is dropped and the DOI transformed again
+            os.remove(path)
+            return None
+
+    def store(self, doi, output):
+        path = self.entry(doi)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp, "wb") as outfile:
+            outfile.write(output)
+        os.replace(tmp, path)
+
+    def invalidate(self, doi):
+        path = self.entry(doi)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def prune(self):
+        # Remove entries made with an older options.yaml or doi2rdm
+        if not os.path.isdir(self.path):
+            return 0
+        current = config_key(self.options)
+        removed = 0
+        for name in os.listdir(self.path):
+            if name != current:
+                shutil.rmtree(os.path.join(self.path, name))
+                removed += 1
+        return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Manage the cache of doi2rdm transformations"
+    )
+    parser.add_argument("command", help="prune, invalidate, clear")
+    parser.add_argument("dois", nargs="*", help="DOIs to invalidate")
+    parser.add_argument("-cache", default=CACHE_DIR, help="Cache directory")
+    args = parser.parse_args()
+
+    cache = TransformCache(args.cache)
+    if args.command == "prune":
+        print(f"Removed {cache.prune()} outdated cache versions")
+    elif args.command == "invalidate":
+        for doi in args.dois:
+            cache.invalidate(doi)
+    elif args.command == "clear":
+        if os.path.isdir(args.cache):
+            shutil.rmtree(args.cache)
+    else:
+        print(f"error= invalid command: {args.command}")
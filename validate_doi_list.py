@@ -1,16 +1,14 @@
 import csv, json
 import requests
-from check_doi import check_doi
-
-deduped = []
+from check_doi import check_dois
 
 with open("full_wos_report_cleaned_2024-03-21.csv", "r") as full_report:
     reader = csv.reader(full_report)
     header = next(reader)
-    for row in reader:
-        doi = row[0]
-        if check_doi(doi) == False:
-            deduped.append(row)
+    rows = list(reader)
+
+existing = check_dois([row[0] for row in rows])
+deduped = [row for row in rows if existing[row[0]] == False]
 
 with open("full_wos_report_cleaned_2024-07-04.csv", "w") as full_report:
     writer = csv.writer(full_report)
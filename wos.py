@@ -1,5 +1,5 @@
-import requests
 import os, urllib
+from sessions import get_session
 
 
 def extract_dois(records, dois):
@@ -22,25 +22,34 @@ def extract_dois(records, dois):
                     print(rec["cluster_related"]["identifiers"])
 
 
-def get_wos_dois(harvest_period):
-    """Get all DOIs from Web of Science for the harvest period (5D or 2M or 1Y etc...)"""
+def get_wos_dois(harvest_period, publish_span=None):
+    """Get all DOIs from Web of Science for the harvest period (5D or 2M or 1Y etc...)
+
+    With publish_span (start, end) the harvest covers records published
+    between the two YYYY-MM-DD dates instead of a load time span.
+    """
 
     token = os.environ["WOSTOK"]
     headers = {"X-ApiKey": token, "Content-type": "application/json"}
 
     base_url = "https://api.clarivate.com/api/wos/?databaseId=WOK"
 
-    base_url = base_url + "&loadTimeSpan=" + str(harvest_period)
+    if publish_span is not None:
+        base_url = base_url + "&publishTimeSpan=" + "+".join(publish_span)
+    else:
+        base_url = base_url + "&loadTimeSpan=" + str(harvest_period)
 
     query = """AD=(((91125 OR "California Institute of Technology" OR "Caltech" OR "Thirty-meter Telescope") not (91109 or (jet and prop and lab))) OR (91125 AND 91109))"""
 
     query = urllib.parse.quote_plus(query)
     url = base_url + "&usrQuery=" + query + "&count=100&firstRecord=1"
 
-    response = requests.get(url, headers=headers)
+    response = get_session().get(url, headers=headers)
     response = response.json()
     record_count = response["QueryResult"]["RecordsFound"]
     print(record_count, " Records from WOS")
+    if record_count == 0:
+        return []
     query_id = response["QueryResult"]["QueryID"]
     try:
         records = response["Data"]["Records"]["records"]["REC"]
@@ -64,7 +73,7 @@ def get_wos_dois(harvest_period):
                 + "?count=100&firstRecord="
                 + str(record_start)
             )
-            response = requests.get(url, headers=headers)
+            response = get_session().get(url, headers=headers)
             response = response.json()
             try:
                 records = response["Records"]["records"]["REC"]
@@ -83,7 +92,7 @@ def get_wos_dois(harvest_period):
                 + "&firstRecord="
                 + str(record_start)
             )
-            response = requests.get(url, headers=headers)
+            response = get_session().get(url, headers=headers)
             response = response.json()
             records = response["Records"]["records"]["REC"]
             extract_dois(records, dois)